@@ -1,23 +1,37 @@
-from fastapi import APIRouter, Depends, HTTPException, Request, status
+from fastapi import APIRouter, Depends, HTTPException, Request, Response, status
 from fastapi.responses import FileResponse
 from typing import Annotated, Callable,  get_type_hints
 from pydantic import create_model
 from fastapi.security import OAuth2PasswordRequestForm
+from starlette.concurrency import run_in_threadpool
 import json
 from autodla.engine.web_connection import EndpointMaker, WebConnection
 from autodla.engine.lambda_conversion import json_to_lambda_str
 import inspect
 
+async def call_object_method(object, method_name, *args, **kwargs):
+    if object.is_async():
+        return await getattr(object, f"a{method_name}")(*args, **kwargs)
+    return await run_in_threadpool(getattr(object, method_name), *args, **kwargs)
+
 class FastApiEndpointMaker(EndpointMaker):
     @classmethod
     def list(cls, object) -> Callable:
-        async def read_object(limit=10, filter:str=None):
-            if filter is None:
-                res = object.all(limit)
-            else:
-                filter_dict = json.loads(filter)
-                lambda_st = json_to_lambda_str(filter_dict)
-                res = object.filter(lambda_st, limit)
+        async def read_object(response: Response, limit=10, filter:str=None, order_by:str=None, after:str=None, fields:str=None):
+            order_by = order_by or object.identifier_field
+            try:
+                if filter is None:
+                    res = await call_object_method(object, "all", limit, order_by=order_by, after=after, lazy=False, fields=fields)
+                else:
+                    filter_dict = json.loads(filter)
+                    lambda_st = json_to_lambda_str(filter_dict)
+                    res = await call_object_method(object, "filter", lambda_st, limit, order_by=order_by, after=after, lazy=False, fields=fields)
+            except ValueError as e:
+                raise HTTPException(400, str(e))
+            if limit and len(res) == int(limit):
+                response.headers["X-Next-Cursor"] = object.next_cursor(res, order_by)
+            if fields is not None:
+                return res
             out = []
             for i in res:
                 out.append(i.to_dict())
@@ -27,7 +41,7 @@ class FastApiEndpointMaker(EndpointMaker):
     @classmethod
     def get(cls, object) -> Callable:
         async def get_object_id(id_param: str):
-            res = object.get_by_id(id_param)
+            res = await call_object_method(object, "get_by_id", id_param, lazy=False)
             if res is None:
                 return HTTPException(400, f'{object.__name__} not found')
             return res.to_dict()
@@ -36,17 +50,20 @@ class FastApiEndpointMaker(EndpointMaker):
     @classmethod
     def get_history(cls, object) -> Callable:
         async def get_object_history_id(id_param: str):
-            res = object.get_by_id(id_param)
+            res = await call_object_method(object, "get_by_id", id_param)
             if res is None:
                 return HTTPException(400, f'{object.__name__} not found')
-            return res.history()
+            return await call_object_method(res, "history")
         return get_object_history_id
 
     @classmethod
     def table(cls, object) -> Callable:
-        async def read_table(limit=10, only_current=True, only_active=True):
-            res = object.get_table_res(limit=limit, only_current=only_current, only_active=only_active).to_dicts()
-            return res
+        async def read_table(limit=10, only_current=True, only_active=True, fields:str=None):
+            try:
+                res = await call_object_method(object, "get_table_res", limit=limit, only_current=only_current, only_active=only_active, fields=fields)
+            except ValueError as e:
+                raise HTTPException(400, str(e))
+            return res.to_dicts()
         return read_table
 
     @classmethod
@@ -54,23 +71,23 @@ class FastApiEndpointMaker(EndpointMaker):
         fields = get_type_hints(object)
         RequestModel = create_model(f"{object.__name__}Request", **{k: (v, ...) for k, v in fields.items()})
         async def create_object(obj: RequestModel):
-            n = object.new(**obj.model_dump())
+            n = await call_object_method(object, "new", **obj.model_dump())
             return n.to_dict()
         return create_object
 
     @classmethod
     def edit(cls, object) -> Callable:
         async def edit_object(id_param, data: dict):
-            obj = object.get_by_id(id_param)
-            obj.update(**data)
+            obj = await call_object_method(object, "get_by_id", id_param, lazy=False)
+            await call_object_method(obj, "update", **data)
             return obj.to_dict()
         return edit_object
 
     @classmethod
     def delete(cls, object) -> Callable:
         async def delete_object(id_param: str):
-            obj = object.get_by_id(id_param)
-            obj.delete()
+            obj = await call_object_method(object, "get_by_id", id_param)
+            await call_object_method(obj, "delete")
             return {"status": "done"}
         return delete_object
 
@@ -1,3 +1,9 @@
-from .postgresdb import PostgresDB
+from .postgresdb import PostgresDB, PostgresInvalidationChannel
 
-__all__ = ["PostgresDB"]
\ No newline at end of file
+def __getattr__(name):
+    if name == "AsyncPostgresDB":
+        from .async_postgresdb import AsyncPostgresDB
+        return AsyncPostgresDB
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+__all__ = ["PostgresDB", "PostgresInvalidationChannel", "AsyncPostgresDB"]
@@ -0,0 +1,244 @@
+import asyncio
+import asyncpg
+import io
+import polars as pl
+import re
+from autodla.dbs.postgresdb import PostgresDB, PostgresDataTransformer, PostgresQueryBuilder, read_copy, write_copy, CONNECTION_URL, VERBOSE, POOL_MIN_SIZE, POOL_MAX_SIZE, POOL_TIMEOUT
+from autodla.engine.cache import LRUCache
+from autodla.engine.db import DB_Connection
+from autodla.engine.query_builder import Query
+from contextlib import asynccontextmanager
+from contextvars import ContextVar
+from typing import Union
+
+PARAM_PATTERN = re.compile(r'%%|(\b(?:(NOT)\s+)?IN\s+)?%s', re.IGNORECASE)
+# the Postgres protocol counts bind parameters with an int16
+MAX_QUERY_PARAMS = 32767
+
+class AsyncPostgresDB(PostgresDB):
+
+    def __init__(self, connection_url=CONNECTION_URL, min_size=POOL_MIN_SIZE, max_size=POOL_MAX_SIZE, timeout=POOL_TIMEOUT):
+        self.__connection_url = connection_url
+        self.__min_size = min_size
+        self.__max_size = max_size
+        self.__timeout = timeout
+        self.__pool = None
+        self.__pool_lock = asyncio.Lock()
+        self.__current_connection = ContextVar(f"autodla_async_postgres_connection_{id(self)}", default=None)
+        self.__transaction = ContextVar(f"autodla_async_postgres_transaction_{id(self)}", default=None)
+        self.__columns = LRUCache(1024)
+        dt = PostgresDataTransformer()
+        DB_Connection.__init__(self, dt, PostgresQueryBuilder(dt))
+
+    @property
+    def is_async(self) -> bool:
+        return True
+
+    @property
+    def max_query_params(self) -> int:
+        return MAX_QUERY_PARAMS
+
+    @property
+    def pool(self) -> asyncpg.Pool:
+        return self.__pool
+
+    @staticmethod
+    async def __init_connection(conn):
+        await conn.set_type_codec('uuid', encoder=str, decoder=str, schema='pg_catalog', format='text')
+
+    async def __get_pool(self) -> asyncpg.Pool:
+        if self.__pool is None:
+            async with self.__pool_lock:
+                if self.__pool is None:
+                    self.__pool = await asyncpg.create_pool(
+                        self.__connection_url,
+                        min_size=self.__min_size,
+                        max_size=self.__max_size,
+                        init=self.__init_connection
+                    )
+        return self.__pool
+
+    @asynccontextmanager
+    async def connection(self):
+        conn = self.__current_connection.get()
+        if conn is not None:
+            yield conn
+            return
+        pool = await self.__get_pool()
+        async with pool.acquire(timeout=self.__timeout) as conn:
+            token = self.__current_connection.set(conn)
+            try:
+                yield conn
+            finally:
+                self.__current_connection.reset(token)
+
+    async def close(self):
+        if self.__pool is not None:
+            await self.__pool.close()
+            self.__pool = None
+
+    @property
+    def in_transaction(self) -> bool:
+        return self.__transaction.get() is not None
+
+    async def begin(self):
+        if self.in_transaction:
+            raise RuntimeError("a transaction is already in progress")
+        conn = self.__current_connection.get()
+        owned = conn is None
+        if owned:
+            pool = await self.__get_pool()
+            conn = await pool.acquire(timeout=self.__timeout)
+            self.__current_connection.set(conn)
+        transaction = conn.transaction()
+        try:
+            await transaction.start()
+        except Exception:
+            if owned:
+                self.__current_connection.set(None)
+                await pool.release(conn)
+            raise
+        self.__transaction.set((conn, transaction, owned))
+
+    async def __end_transaction(self, commit):
+        if not self.in_transaction:
+            raise RuntimeError("no transaction in progress")
+        conn, transaction, owned = self.__transaction.get()
+        self.__transaction.set(None)
+        try:
+            if commit:
+                await transaction.commit()
+            else:
+                await transaction.rollback()
+        finally:
+            if owned:
+                self.__current_connection.set(None)
+                await self.__pool.release(conn)
+
+    async def commit(self):
+        await self.__end_transaction(True)
+
+    async def rollback(self):
+        await self.__end_transaction(False)
+
+    @staticmethod
+    def to_native(statement: Query) -> tuple[str, list]:
+        params = iter(statement.params)
+        args = []
+        def replace(match):
+            if match.group(0) == '%%':
+                return '%'
+            value = next(params)
+            prefix = match.group(1) or ''
+            if type(value) != tuple:
+                args.append(value)
+                return f'{prefix}${len(args)}'
+            # a flat IN list is sent as a single array so its size is not bound by the parameter limit
+            if prefix and all([type(v) != tuple for v in value]):
+                args.append(list(value))
+                return f"{'<> ALL' if match.group(2) else '= ANY'}(${len(args)})"
+            if len(value) == 0:
+                return f'{prefix}(NULL)'
+            placeholders = []
+            for v in value:
+                if type(v) == tuple:
+                    args.extend(v)
+                    placeholders.append(f"({', '.join([f'${len(args) - len(v) + i + 1}' for i in range(len(v))])})")
+                else:
+                    args.append(v)
+                    placeholders.append(f'${len(args)}')
+            return f"{prefix}({', '.join(placeholders)})"
+        return PARAM_PATTERN.sub(replace, statement.st), args
+
+    async def open_cursor(self, statement):
+        statement = self.normalize_statment(statement)
+        st, args = self.to_native(statement)
+        frame_schema = None
+        if statement.result_schema:
+            frame_schema = self.data_transformer.get_frame_schema(statement.result_schema)
+        conn = self.__current_connection.get()
+        owned = conn is None
+        if owned:
+            pool = await self.__get_pool()
+            conn = await pool.acquire(timeout=self.__timeout)
+        transaction = None
+        try:
+            # asyncpg cursors only live inside a transaction
+            if not conn.is_in_transaction():
+                transaction = conn.transaction()
+                await transaction.start()
+            cursor = await conn.cursor(st.rstrip(';'), *args)
+        except Exception:
+            if transaction is not None:
+                await transaction.rollback()
+            if owned:
+                await pool.release(conn)
+            raise
+        return {"conn": conn, "cursor": cursor, "transaction": transaction, "owned": owned, "schema": frame_schema}
+
+    async def fetch_cursor(self, cursor, size):
+        rows = await cursor["cursor"].fetch(size)
+        schema = cursor["schema"]
+        if schema is None:
+            if not rows:
+                return None
+            schema = list(rows[0].keys())
+        return pl.DataFrame([tuple(row) for row in rows], schema=schema, orient='row')
+
+    async def close_cursor(self, cursor):
+        try:
+            if cursor["transaction"] is not None:
+                await cursor["transaction"].rollback()
+        finally:
+            if cursor["owned"]:
+                await self.__pool.release(cursor["conn"])
+
+    async def copy_in(self, table_name : str, schema : dict, rows : list[dict]):
+        frame_schema = self.data_transformer.get_frame_schema(schema)
+        if frame_schema is None:
+            return await DB_Connection.copy_in(self, table_name, schema, rows)
+        data = write_copy(rows, schema, frame_schema, self.data_transformer.convert_param)
+        schema_name, _, table = table_name.rpartition('.')
+        async with self.connection() as conn:
+            await conn.copy_to_table(table, source=io.BytesIO(data), columns=list(frame_schema.keys()), schema_name=schema_name or None, format='csv')
+
+    async def execute(self, statement : Union[Query, str], commit=True) -> pl.DataFrame:
+        statement = self.normalize_statment(statement)
+        st, args = self.to_native(statement)
+        frame_schema = None
+        if statement.result_schema:
+            frame_schema = self.data_transformer.get_frame_schema(statement.result_schema)
+        async with self.connection() as conn:
+            if VERBOSE:
+                print()
+                print("$$$$$$ SQL STATEMENT $$$$$$")
+                print(st)
+                print(args)
+            if frame_schema is not None:
+                chunks = []
+                async def write(chunk):
+                    chunks.append(chunk)
+                await conn.copy_from_query(st.rstrip(';'), *args, output=write, format='csv', force_quote=True)
+                out = read_copy(b"".join(chunks), frame_schema)
+                if VERBOSE:
+                    print()
+                    print(out)
+                return out
+            rows = await conn.fetch(st, *args)
+            if rows:
+                schema = list(rows[0].keys())
+            else:
+                schema = self.__columns.get(st)
+                if schema is None:
+                    prepared = await conn.prepare(st)
+                    schema = [attribute.name for attribute in prepared.get_attributes()]
+                    self.__columns.put(st, schema)
+            if not schema:
+                return None
+            out = pl.DataFrame([tuple(row) for row in rows], schema=schema, orient='row')
+            if VERBOSE:
+                print()
+                print(out)
+                print("$$$$$$$$$$$$$")
+                print()
+            return out
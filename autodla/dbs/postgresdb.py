@@ -1,11 +1,25 @@
+import io
 import psycopg2
 import polars as pl
 from autodla.engine.data_conversion import DataTransformer, DataConversion
 from autodla.engine.db import DB_Connection
 from autodla.engine.object import primary_key
-from autodla.engine.query_builder import QueryBuilder
+from autodla.engine.query_builder import Query, QueryBuilder
+from autodla.engine.cache import InvalidationChannel, LRUCache
+from autodla.engine.operation import Operation
+from autodla.engine.pool import ConnectionPool
+from functools import partial
+from contextlib import contextmanager
+from contextvars import ContextVar
 from datetime import date, datetime
-from typing import List, Optional
+from typing import List, Optional, Union
+import json
+import re
+import select
+import threading
+import time
+import uuid
+import weakref
 from uuid import UUID
 import os
 
@@ -27,55 +41,128 @@ if "AUTODLA_POSTGRES_DB" in os.environ:
 VERBOSE = False
 if "AUTODLA_SQL_VERBOSE" in os.environ:
     VERBOSE = os.environ.get("AUTODLA_SQL_VERBOSE")
+PREPARE_THRESHOLD = 5
+if "AUTODLA_POSTGRES_PREPARE_THRESHOLD" in os.environ:
+    PREPARE_THRESHOLD = int(os.environ.get("AUTODLA_POSTGRES_PREPARE_THRESHOLD"))
+MAX_PREPARED_STATEMENTS = 256
+# typed reads that can return more rows than this always go through COPY instead of a prepared statement
+PREPARED_READ_MAX_ROWS = 1000
+POOL_MIN_SIZE = 1
+if "AUTODLA_POSTGRES_POOL_MIN_SIZE" in os.environ:
+    POOL_MIN_SIZE = int(os.environ.get("AUTODLA_POSTGRES_POOL_MIN_SIZE"))
+POOL_MAX_SIZE = 10
+if "AUTODLA_POSTGRES_POOL_MAX_SIZE" in os.environ:
+    POOL_MAX_SIZE = int(os.environ.get("AUTODLA_POSTGRES_POOL_MAX_SIZE"))
+POOL_TIMEOUT = 30.0
+if "AUTODLA_POSTGRES_POOL_TIMEOUT" in os.environ:
+    POOL_TIMEOUT = float(os.environ.get("AUTODLA_POSTGRES_POOL_TIMEOUT"))
+
+INVALIDATION_CHANNEL = "autodla_invalidation"
+if "AUTODLA_POSTGRES_INVALIDATION_CHANNEL" in os.environ:
+    INVALIDATION_CHANNEL = os.environ.get("AUTODLA_POSTGRES_INVALIDATION_CHANNEL")
 
 CONNECTION_URL = f"postgresql://{POSTGRES_USER}:{POSTGRES_PASSWORD}@{POSTGRES_URL}/{POSTGRES_DB}"
 
 class PostgresQueryBuilder(QueryBuilder):
-    def select(self, from_table: str, columns: List[str], where: str = None, limit: int = 10, order_by: str = None, group_by: list[str] = None) -> pl.DataFrame:
+    def select(self, from_table: str, columns: List[str], where: Union[Query, str] = None, limit: int = 10, order_by: str = None, group_by: list[str] = None) -> Query:
         qry = "SELECT " + ", ".join(columns) + " FROM " + from_table
+        params = ()
+        where = Query.of(where)
         if where:
-            qry += " WHERE " + where
+            qry += " WHERE " + where.st
+            params += where.params
         if order_by:
             qry += " ORDER BY " + order_by
         if limit:
-            qry += " LIMIT " + str(limit)
-        return qry
+            qry += " LIMIT %s"
+            params += (int(limit),)
+        return Query(qry, params, limit=int(limit) if limit else None)
 
-    def insert(self, into_table: str, values: List[dict]) -> None:
+    def insert(self, into_table: str, values: List[dict]) -> Query:
+        row_st = f"({', '.join(['%s'] * len(values[0]))})"
         qry = "INSERT INTO " + into_table + " (" + ", ".join(values[0].keys()) + ") VALUES "
-        qry += ", ".join([f"({', '.join([self._data_transformer.convert_data(v) for v in d.values()])})" for d in values])
-        return qry
+        qry += ", ".join([row_st] * len(values))
+        params = tuple([self._data_transformer.convert_param(d[k]) for d in values for k in values[0].keys()])
+        return Query(qry, params)
+
+    def update(self, table: str, values: dict, where: Union[Query, str]) -> Query:
+        where = Query.of(where)
+        qry = f"UPDATE {table} SET {', '.join([f'{k.upper()} = %s' for k in values.keys()])} WHERE {where.st}"
+        params = tuple([self._data_transformer.convert_param(v) for v in values.values()])
+        return Query(qry, params + where.params)
 
-    def update(self, table: str, values: dict, where: str) -> None:
-        qry = f"UPDATE {table} SET {', '.join([f'{k.upper()} = {self._data_transformer.convert_data(v)}' for k, v in values.items()])} WHERE {where}"
-        return qry
+    def delete(self, table: str, where: Union[Query, str]) -> Query:
+        where = Query.of(where)
+        qry = f"DELETE FROM {table} WHERE {where.st}"
+        return Query(qry, where.params)
 
-    def delete(self, table: str, where: str) -> None:
-        qry = f"DELETE FROM {table} WHERE {where}"
-        return qry
+    def move_rows(self, from_table: str, to_table: str, columns: List[str], where: Union[Query, str], values: dict = {}) -> Query:
+        where = Query.of(where)
+        values = {k.upper(): v for k, v in values.items()}
+        selected = [f"%s AS {k}" if k.upper() in values else k for k in columns]
+        params = tuple([self._data_transformer.convert_param(values[k.upper()]) for k in columns if k.upper() in values])
+        qry = f"WITH moved AS (DELETE FROM {from_table} WHERE {where.st} RETURNING {', '.join(columns)}) INSERT INTO {to_table} ({', '.join(columns)}) SELECT {', '.join(selected)} FROM moved"
+        return Query(qry, where.params + params)
 
-    def create_table(self, table_name: str, schema: dict, if_exists = False) -> None:
+    def create_table(self, table_name: str, schema: dict, if_exists = False, partition_by: str = None) -> Query:
         if_exists_st = "IF EXISTS" if if_exists else ""
         items = [f'{k} {v}' for k, v in schema.items()]
-        qry = f"CREATE TABLE {if_exists_st} {table_name} ({', '.join(items)});"
-        return qry
+        qry = f"CREATE TABLE {if_exists_st} {table_name} ({', '.join(items)})"
+        if partition_by:
+            qry += f" PARTITION BY RANGE ({partition_by})"
+        return Query(qry + ";")
+
+    def create_table_like(self, table_name: str, like_table: str) -> Query:
+        return Query(f"CREATE TABLE {table_name} (LIKE {like_table} INCLUDING DEFAULTS);")
+
+    def attach_partition(self, table_name: str, partition_name: str, start = None, end = None) -> Query:
+        # partition bounds must be literals, DDL doesn't take parameters
+        if start is None:
+            bounds = "DEFAULT"
+        else:
+            bounds = f"FOR VALUES FROM ({self._data_transformer.convert_data(start)}) TO ({self._data_transformer.convert_data(end)})"
+        return Query(f"ALTER TABLE {table_name} ATTACH PARTITION {partition_name} {bounds};")
 
-    def drop_table(self, table_name: str, if_exists = False) -> None:
+    def detach_partition(self, table_name: str, partition_name: str) -> Query:
+        return Query(f"ALTER TABLE {table_name} DETACH PARTITION {partition_name};")
+
+    def drop_table(self, table_name: str, if_exists = False) -> Query:
         if_exists_st = "IF EXISTS" if if_exists else ""
         qry = f"DROP TABLE {if_exists_st} {table_name};"
-        return qry
+        return Query(qry)
+
+    def create_index(self, table_name: str, columns: List[str], where: str = None, if_not_exists = True) -> Query:
+        if_not_exists_st = "IF NOT EXISTS" if if_not_exists else ""
+        qry = f"CREATE INDEX {if_not_exists_st} {self.index_name(table_name, columns, where)} ON {table_name} ({', '.join(columns)})"
+        if where:
+            qry += f" WHERE {where}"
+        return Query(qry)
+
+    def add_column(self, table_name: str, column: str, sql_type: str, not_null = False, default: str = None) -> Query:
+        qry = f"ALTER TABLE {table_name} ADD COLUMN IF NOT EXISTS {column} {sql_type}"
+        if default is not None:
+            qry += f" DEFAULT {default.replace('%', '%%')}"
+        if not_null:
+            qry += " NOT NULL"
+        return Query(qry)
+
+    def alter_column_type(self, table_name: str, column: str, sql_type: str) -> Query:
+        return Query(f"ALTER TABLE {table_name} ALTER COLUMN {column} TYPE {sql_type} USING {column}::{sql_type}")
+
+    def drop_not_null(self, table_name: str, column: str) -> Query:
+        return Query(f"ALTER TABLE {table_name} ALTER COLUMN {column} DROP NOT NULL")
 
 class PostgresDataTransformer(DataTransformer):
     TYPE_DICT= {
-        UUID: DataConversion("UUID", lambda x: f"'{x}'"),
-        primary_key: DataConversion("UUID", lambda x: f"'{x}'"),
+        UUID: DataConversion("UUID", lambda x: f"'{x}'", str, pl.String),
+        primary_key: DataConversion("UUID", lambda x: f"'{x}'", str, pl.String),
         type(None): DataConversion('', lambda x: "NULL"),
-        int: DataConversion('INTEGER'),
-        float: DataConversion("REAL"),
-        str: DataConversion("TEXT", lambda x: f"'{x}'"),
-        bool: DataConversion("BOOL", lambda x: {True: "TRUE", False: "FALSE"}[x]),
-        date: DataConversion("DATE", lambda x: f"'{x.year}-{x.month}-{x.day}'"),
-        datetime: DataConversion("TIMESTAMP", lambda x: f"'{x.strftime(DATETIME_FORMAT)}'"),
+        int: DataConversion('INTEGER', dtype=pl.Int64),
+        float: DataConversion("REAL", dtype=pl.Float64),
+        str: DataConversion("TEXT", lambda x: "'" + x.replace("'", "''") + "'", dtype=pl.String),
+        bool: DataConversion("BOOL", lambda x: {True: "TRUE", False: "FALSE"}[x], dtype=pl.Boolean),
+        date: DataConversion("DATE", lambda x: f"'{x.year}-{x.month}-{x.day}'", dtype=pl.Date),
+        datetime: DataConversion("TIMESTAMP", lambda x: f"'{x.strftime(DATETIME_FORMAT)}'", dtype=pl.Datetime("us")),
     }
     OPERATOR_DICT = {
         "numeric": {
@@ -96,7 +183,7 @@ class PostgresDataTransformer(DataTransformer):
             "Mult": lambda x, y: f'{x} * {y}',
             "Div": lambda x, y: f'{x} / {y}',
             "FloorDiv": lambda x, y: f'FLOOR({x} / {y})',
-            "Mod": lambda x, y: f'{x} % {y}',
+            "Mod": lambda x, y: f'{x} %% {y}',
             "Pow": lambda x, y: f'POWER({x},{y})'
         },
         "boolean": {
@@ -112,54 +199,357 @@ class PostgresDataTransformer(DataTransformer):
         UUID: primary_key
     }
 
+PARAM_PATTERN = re.compile(r'%%|%s')
+PARTITION_BOUND_PATTERN = re.compile(r"FROM \('([^']*)'\) TO \('([^']*)'\)")
+
+def copy_statement(st : str) -> str:
+    return f"COPY ({st.rstrip(';')}) TO STDOUT WITH (FORMAT csv, FORCE_QUOTE *)"
+
+def write_copy(rows : list[dict], schema : dict, frame_schema : dict, convert) -> bytes:
+    keys = list(schema.keys())
+    frame = pl.DataFrame([[convert(row[k]) for k in keys] for row in rows], schema=frame_schema, orient='row')
+    return frame.write_csv(include_header=False).encode()
+
+def read_copy(data : bytes, schema : dict) -> pl.DataFrame:
+    if not data:
+        return pl.DataFrame(schema=schema)
+    # COPY writes booleans as t/f, read them as text and compare
+    bool_columns = [k for k, v in schema.items() if v == pl.Boolean]
+    out = pl.read_csv(data, has_header=False, schema={k: pl.String if k in bool_columns else v for k, v in schema.items()})
+    if bool_columns:
+        out = out.with_columns([(pl.col(k) == 't').alias(k) for k in bool_columns])
+    return out
+
 class PostgresDB(DB_Connection):
 
-    def __init__(self, connection_url=CONNECTION_URL):
-        self.__db_connection = psycopg2.connect(connection_url)
+    def __init__(self, connection_url=CONNECTION_URL, prepare_threshold=PREPARE_THRESHOLD, min_size=POOL_MIN_SIZE, max_size=POOL_MAX_SIZE, timeout=POOL_TIMEOUT):
+        self.__prepare_threshold = prepare_threshold
+        self.__statement_counts = LRUCache(4 * MAX_PREPARED_STATEMENTS)
+        self.__prepared = weakref.WeakKeyDictionary()
+        self.__current_connection = ContextVar(f"autodla_postgres_connection_{id(self)}", default=None)
+        self.__transaction = ContextVar(f"autodla_postgres_transaction_{id(self)}", default=None)
+        self.__pool = ConnectionPool(
+            lambda: psycopg2.connect(connection_url),
+            min_size=min_size,
+            max_size=max_size,
+            timeout=timeout,
+            check=self.__check_connection,
+            reset=self.__reset_connection
+        )
         dt = PostgresDataTransformer()
         super().__init__(dt, PostgresQueryBuilder(dt))
+
+    @property
+    def pool(self) -> ConnectionPool:
+        return self.__pool
+
+    @staticmethod
+    def __check_connection(conn):
+        if conn.closed:
+            return False
+        with conn.cursor() as cursor:
+            cursor.execute("SELECT 1")
+        conn.rollback()
+        return True
+
+    @staticmethod
+    def __reset_connection(conn):
+        if conn.closed:
+            raise psycopg2.InterfaceError("connection already closed")
+        if conn.info.transaction_status != psycopg2.extensions.TRANSACTION_STATUS_IDLE:
+            conn.rollback()
+
+    @contextmanager
+    def connection(self):
+        conn = self.__current_connection.get()
+        if conn is not None:
+            yield conn
+            return
+        with self.__pool.connection() as conn:
+            token = self.__current_connection.set(conn)
+            try:
+                yield conn
+            finally:
+                self.__current_connection.reset(token)
+
+    def close(self):
+        self.__pool.closeall()
+
+    @property
+    def in_transaction(self) -> bool:
+        return self.__transaction.get() is not None
+
+    def begin(self):
+        if self.in_transaction:
+            raise RuntimeError("a transaction is already in progress")
+        conn = self.__current_connection.get()
+        owned = conn is None
+        if owned:
+            conn = self.__pool.getconn()
+            self.__current_connection.set(conn)
+        self.__transaction.set((conn, owned))
+
+    def __end_transaction(self, commit):
+        if not self.in_transaction:
+            raise RuntimeError("no transaction in progress")
+        conn, owned = self.__transaction.get()
+        self.__transaction.set(None)
+        try:
+            if commit:
+                conn.commit()
+            else:
+                conn.rollback()
+        finally:
+            if owned:
+                self.__current_connection.set(None)
+                self.__pool.putconn(conn)
+
+    def commit(self):
+        self.__end_transaction(True)
+
+    def rollback(self):
+        self.__end_transaction(False)
     
-    def get_table_definition(self, table_name) -> dict[str, type]:
+    @staticmethod
+    def __split_table_name(table_name):
         if "." in table_name:
-            table_name = table_name.split(".")[-1]
-        res = self.execute(self.query.select(
+            return tuple(table_name.split(".")[-2:])
+        return ("public", table_name)
+
+    def get_table_definition(self, table_name) -> Operation:
+        out = yield from self.get_table_definitions([table_name])
+        return {k: v["type"] for k, v in out[table_name].items()}
+
+    def get_table_definitions(self, table_names : list[str]) -> Operation:
+        keys = {self.__split_table_name(i): i for i in table_names}
+        res = yield partial(self.execute, self.query.select(
             from_table='INFORMATION_SCHEMA.COLUMNS',
-            columns=["column_name", "data_type"],
+            columns=["table_schema", "table_name", "column_name", "data_type", "is_nullable"],
             limit=None,
-            where=f"table_name = '{table_name}'"
-        )).to_dicts()
+            where=Query("(table_schema, table_name) IN %s", (tuple(keys.keys()),))
+        ))
         conversion_dict = {
             "boolean": "bool",
             "timestamp without time zone": "timestamp"
         }
-        out = {}
-        for row in res:
+        out = {i: {} for i in table_names}
+        for row in res.to_dicts():
             if row['data_type'] in conversion_dict:
                 row['data_type'] = conversion_dict[row['data_type']]
-            out[row['column_name'].upper()] = self.data_transformer.get_type_from_sql_type(row["data_type"])
+            table_name = keys[(row['table_schema'], row['table_name'])]
+            out[table_name][row['column_name'].upper()] = {
+                "type": self.data_transformer.get_type_from_sql_type(row["data_type"]),
+                "nullable": row["is_nullable"] == "YES"
+            }
+        return out
+
+    def get_table_indexes(self, table_names : list[str]) -> Operation:
+        keys = {self.__split_table_name(i): i for i in table_names}
+        res = yield partial(self.execute, self.query.select(
+            from_table='pg_indexes',
+            columns=["schemaname", "tablename", "indexname"],
+            limit=None,
+            where=Query("(schemaname, tablename) IN %s", (tuple(keys.keys()),))
+        ))
+        out = {i: set() for i in table_names}
+        for row in res.to_dicts():
+            out[keys[(row['schemaname'], row['tablename'])]].add(row['indexname'])
+        return out
+
+    def get_table_partitions(self, table_names : list[str]) -> Operation:
+        keys = {self.__split_table_name(i): i for i in table_names}
+        res = yield partial(self.execute, Query(
+            "SELECT ns.nspname AS table_schema, parent.relname AS table_name, child.relname AS partition_name, pg_get_expr(child.relpartbound, child.oid) AS bound "
+            "FROM pg_partitioned_table pt JOIN pg_class parent ON parent.oid = pt.partrelid JOIN pg_namespace ns ON ns.oid = parent.relnamespace "
+            "LEFT JOIN pg_inherits inh ON inh.inhparent = parent.oid LEFT JOIN pg_class child ON child.oid = inh.inhrelid "
+            "WHERE (ns.nspname, parent.relname) IN %s",
+            (tuple(keys.keys()),)
+        ))
+        out = {}
+        for row in res.to_dicts():
+            table_name = keys[(row['table_schema'], row['table_name'])]
+            partitions = out.setdefault(table_name, {})
+            if row['partition_name'] is None:
+                continue
+            partition_name = f"{row['table_schema']}.{row['partition_name']}" if "." in table_name else row['partition_name']
+            if row['bound'] == 'DEFAULT':
+                partitions[partition_name] = (None, None)
+                continue
+            bound = PARTITION_BOUND_PATTERN.search(row['bound'] or '')
+            if bound is None:
+                continue
+            partitions[partition_name] = (datetime.fromisoformat(bound.group(1)), datetime.fromisoformat(bound.group(2)))
         return out
+
+    def __prepared_statement(self, conn, cursor, statement: Query):
+        if not self.__prepare_threshold or any([type(p) in [tuple, list] for p in statement.params]):
+            return None
+        prepared = self.__prepared.setdefault(conn, {})
+        if statement.st in prepared:
+            return prepared[statement.st]
+        count = self.__statement_counts.get(statement.st, 0) + 1
+        self.__statement_counts.put(statement.st, count)
+        if count < self.__prepare_threshold or len(prepared) >= MAX_PREPARED_STATEMENTS:
+            return None
+        name = f"autodla_{len(prepared)}"
+        position = iter(range(1, len(statement.params) + 1))
+        prepared_st = PARAM_PATTERN.sub(lambda m: '%' if m.group(0) == '%%' else f'${next(position)}', statement.st)
+        cursor.execute("SAVEPOINT autodla_prepare")
+        try:
+            cursor.execute(f"PREPARE {name} AS {prepared_st}")
+            cursor.execute("RELEASE SAVEPOINT autodla_prepare")
+        except psycopg2.Error:
+            cursor.execute("ROLLBACK TO SAVEPOINT autodla_prepare")
+            name = None
+        prepared[statement.st] = name
+        return name
                 
+    def __execute_copy(self, cursor, statement: Query, schema: dict) -> pl.DataFrame:
+        buffer = io.BytesIO()
+        cursor.copy_expert(copy_statement(cursor.mogrify(statement.st, statement.params).decode()), buffer)
+        return read_copy(buffer.getvalue(), schema)
+
+    def open_cursor(self, statement):
+        statement = self.normalize_statment(statement)
+        frame_schema = None
+        if statement.result_schema:
+            frame_schema = self.data_transformer.get_frame_schema(statement.result_schema)
+        conn = self.__current_connection.get()
+        owned = conn is None
+        if owned:
+            conn = self.__pool.getconn()
+        try:
+            cursor = conn.cursor(name=f"autodla_cursor_{uuid.uuid4().hex}")
+            cursor.execute(statement.st, statement.params)
+        except Exception:
+            if owned:
+                self.__pool.putconn(conn)
+            raise
+        return {"conn": conn, "cursor": cursor, "owned": owned, "schema": frame_schema}
+
+    def fetch_cursor(self, cursor, size):
+        rows = cursor["cursor"].fetchmany(size)
+        schema = cursor["schema"] or [desc[0] for desc in cursor["cursor"].description]
+        return pl.DataFrame(rows, schema=schema, orient='row')
+
+    def close_cursor(self, cursor):
+        try:
+            cursor["cursor"].close()
+        finally:
+            if cursor["owned"]:
+                self.__pool.putconn(cursor["conn"])
+
+    def copy_in(self, table_name : str, schema : dict, rows : list[dict], commit=True):
+        frame_schema = self.data_transformer.get_frame_schema(schema)
+        if frame_schema is None:
+            return super().copy_in(table_name, schema, rows)
+        data = write_copy(rows, schema, frame_schema, self.data_transformer.convert_param)
+        with self.connection() as conn, conn.cursor() as cursor:
+            try:
+                cursor.copy_expert(f"COPY {table_name} ({', '.join(frame_schema.keys())}) FROM STDIN WITH (FORMAT csv)", io.BytesIO(data))
+            finally:
+                if commit and not self.in_transaction:
+                    conn.commit()
+
     def execute(self, statement, commit=True):
         statement = self.normalize_statment(statement)
-        with self.__db_connection.cursor() as cursor:
+        frame_schema = None
+        if statement.result_schema:
+            frame_schema = self.data_transformer.get_frame_schema(statement.result_schema)
+        with self.connection() as conn, conn.cursor() as cursor:
             if VERBOSE:
                 print()
                 print("$$$$$$ SQL STATEMENT $$$$$$")
-                print(statement)
-            cursor.execute(statement)
+                print(statement.st)
+                print(statement.params)
+            prepared_name = None
+            if frame_schema is None or (statement.limit is not None and statement.limit <= PREPARED_READ_MAX_ROWS):
+                prepared_name = self.__prepared_statement(conn, cursor, statement)
             try:
-                rows = cursor.fetchall()
-                schema = [desc[0] for desc in cursor.description]
-                out = pl.DataFrame(rows, schema=schema, orient='row')
+                if prepared_name is None and frame_schema is not None:
+                    out = self.__execute_copy(cursor, statement, frame_schema)
+                else:
+                    if prepared_name is not None:
+                        placeholders = ", ".join(["%s"] * len(statement.params))
+                        cursor.execute(f"EXECUTE {prepared_name}" + (f" ({placeholders})" if statement.params else ""), statement.params)
+                    else:
+                        cursor.execute(statement.st, statement.params)
+                    try:
+                        rows = cursor.fetchall()
+                    except psycopg2.ProgrammingError:
+                        return None
+                    schema = frame_schema or [desc[0] for desc in cursor.description]
+                    out = pl.DataFrame(rows, schema=schema, orient='row')
                 if VERBOSE:
                     print()
                     print(out)
                 return out
-            except:
-                return None
             finally:
-                if commit:
-                    self.__db_connection.commit()
+                if commit and not self.in_transaction:
+                    conn.commit()
                 if VERBOSE:
                     print("$$$$$$$$$$$$$")
                     print()
+
+
+class PostgresInvalidationChannel(InvalidationChannel):
+    # NOTIFY payloads are limited to 8000 bytes
+    MAX_PAYLOAD_KEYS = 100
+
+    def __init__(self, connection_url=CONNECTION_URL, channel=INVALIDATION_CHANNEL):
+        super().__init__()
+        self.__connection_url = connection_url
+        self.__channel = channel
+        self.__thread = None
+        self.__stop = threading.Event()
+
+    def publish(self, db, class_name, keys):
+        params = ()
+        for i in range(0, len(keys), self.MAX_PAYLOAD_KEYS):
+            payload = json.dumps({"source": self.source, "class": class_name, "keys": keys[i:i + self.MAX_PAYLOAD_KEYS]})
+            params += (self.__channel, payload)
+        st = "SELECT " + ", ".join(["pg_notify(%s, %s)"] * (len(params) // 2))
+        return db.execute(Query(st, params))
+
+    def start(self):
+        if self.__thread is not None:
+            return
+        self.__stop.clear()
+        self.__thread = threading.Thread(target=self.__listen, name="autodla-invalidation", daemon=True)
+        self.__thread.start()
+
+    def close(self):
+        self.__stop.set()
+        if self.__thread is not None:
+            self.__thread.join()
+            self.__thread = None
+
+    def __listen(self):
+        connected_before = False
+        while not self.__stop.is_set():
+            try:
+                conn = psycopg2.connect(self.__connection_url)
+            except psycopg2.Error:
+                time.sleep(1)
+                continue
+            try:
+                conn.autocommit = True
+                with conn.cursor() as cursor:
+                    cursor.execute(f"LISTEN {self.__channel}")
+                if connected_before:
+                    # notifications sent while disconnected are lost
+                    self.receive()
+                connected_before = True
+                while not self.__stop.is_set():
+                    if select.select([conn], [], [], 1.0) == ([], [], []):
+                        continue
+                    conn.poll()
+                    while conn.notifies:
+                        notify = conn.notifies.pop(0)
+                        message = json.loads(notify.payload)
+                        if message["source"] != self.source:
+                            self.receive(message["class"], message["keys"])
+            except psycopg2.Error:
+                time.sleep(1)
+            finally:
+                conn.close()
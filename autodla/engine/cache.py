@@ -0,0 +1,119 @@
+from collections import OrderedDict
+from threading import Lock
+import uuid
+import weakref
+
+class LRUCache:
+    def __init__(self, maxsize=128):
+        self.maxsize = maxsize
+        self.__data = OrderedDict()
+        self.__lock = Lock()
+
+    def get(self, key, default=None):
+        with self.__lock:
+            if key not in self.__data:
+                return default
+            self.__data.move_to_end(key)
+            return self.__data[key]
+
+    def put(self, key, value):
+        with self.__lock:
+            self.__data[key] = value
+            self.__data.move_to_end(key)
+            while len(self.__data) > self.maxsize:
+                self.__data.popitem(last=False)
+
+    def pop(self, key, default=None):
+        with self.__lock:
+            return self.__data.pop(key, default)
+
+    def clear(self):
+        with self.__lock:
+            self.__data.clear()
+
+    def __len__(self):
+        return len(self.__data)
+
+class IdentityMap:
+    # live instances are tracked weakly so every referenced object stays unique,
+    # the most recently used ones are also kept alive by a bounded LRU
+    def __init__(self, maxsize=1024):
+        self.__recent = LRUCache(maxsize)
+        self.__live = weakref.WeakValueDictionary()
+        self.__lock = Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @property
+    def maxsize(self):
+        return self.__recent.maxsize
+
+    def get(self, key, default=None):
+        with self.__lock:
+            obj = self.__live.get(key)
+            if obj is None:
+                self.misses += 1
+                return default
+            self.hits += 1
+        self.__recent.put(key, obj)
+        return obj
+
+    def peek(self, key, default=None):
+        with self.__lock:
+            return self.__live.get(key, default)
+
+    def put(self, key, obj):
+        with self.__lock:
+            self.__live[key] = obj
+        self.__recent.put(key, obj)
+
+    def pop(self, key):
+        with self.__lock:
+            obj = self.__live.pop(key, None)
+        self.__recent.pop(key)
+        return obj
+
+    def values(self) -> list:
+        with self.__lock:
+            return list(self.__live.values())
+
+    def clear(self):
+        with self.__lock:
+            self.__live.clear()
+            self.hits = 0
+            self.misses = 0
+        self.__recent.clear()
+
+    def info(self) -> dict:
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "size": len(self.__live),
+            "maxsize": self.maxsize
+        }
+
+    def __len__(self):
+        return len(self.__live)
+
+class InvalidationChannel:
+    # carries the ids of updated objects between processes, implementations call
+    # receive() for every message published by another process
+    def __init__(self):
+        self.source = uuid.uuid4().hex
+        self.__callbacks = []
+
+    def subscribe(self, callback):
+        self.__callbacks.append(callback)
+
+    def start(self):
+        pass
+
+    def close(self):
+        pass
+
+    def publish(self, db, class_name : str, keys : list[str]):
+        pass
+
+    def receive(self, class_name : str = None, keys : list[str] = None):
+        for callback in self.__callbacks:
+            callback(class_name, keys)
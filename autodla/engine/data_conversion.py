@@ -12,6 +12,8 @@ if "DATETIME_FORMAT" in os.environ:
 class DataConversion:
     name: str
     transform: Callable[[Any], str] = lambda x: f"{x}"
+    param: Callable[[Any], Any] = lambda x: x
+    dtype: Any = None
 
 @dataclass
 class MethodArgument:
@@ -74,6 +76,7 @@ class TypedMethod(GlobalTypedMethod):
         return self.definition(arguments), self.return_type
 
 class DataTransformer:
+    PLACEHOLDER = "%s"
     TYPE_DICT = {}
     OPERATOR_DICT = {
         "numeric": {
@@ -111,7 +114,7 @@ class DataTransformer:
                 ),
                 "startswith": TypedMethod(
                     str, bool,
-                    lambda data: f"({data['caller']} LIKE '{data['value'][1:-1]}%')",
+                    lambda data: f"({data['caller']} LIKE {data['value']} || '%%')",
                     {"value": str}
                 )
             },
@@ -168,6 +171,16 @@ class DataTransformer:
                 v = a[0]
         return cls.TYPE_DICT.get(v)
 
+    @classmethod
+    def get_frame_schema(cls, schema : dict) -> Optional[dict]:
+        out = {}
+        for k, v in schema.items():
+            f = cls.get_data_field(v)
+            if f is None or f.dtype is None:
+                return None
+            out[k.lower()] = f.dtype
+        return out
+
     @classmethod
     def convert_data_schema(cls, schema):
         out = {}
@@ -210,4 +223,13 @@ class DataTransformer:
             return v.transform(data)
         if type(data) == list:
             return f"({', '.join([cls.convert_data(i) for i in data])})"
-        raise TypeError(f"Missing transformer for class {type(data).__name__}")
\ No newline at end of file
+        raise TypeError(f"Missing transformer for class {type(data).__name__}")
+    
+    @classmethod
+    def convert_param(cls, data):
+        v = cls.get_data_field(type(data))
+        if v is not None:
+            return v.param(data)
+        if type(data) in [list, tuple]:
+            return tuple([cls.convert_param(i) for i in data])
+        raise TypeError(f"Missing transformer for class {type(data).__name__}")
@@ -1,7 +1,28 @@
 import polars as pl
+from autodla.engine.cache import InvalidationChannel
 from autodla.engine.data_conversion import DataTransformer
-from autodla.engine.query_builder import QueryBuilder
-from typing import get_origin, get_args
+from autodla.engine.operation import Operation, run_async, run_sync
+from autodla.engine.partitioning import PARTITION_KEY, partition_end, partition_ranges, partition_start
+from autodla.engine.query_builder import Query, QueryBuilder
+from autodla.engine.unit_of_work import Transaction, UnitOfWork
+from contextvars import ContextVar
+from datetime import datetime
+from functools import partial
+from typing import Callable, Union, get_origin, get_args
+import os
+
+# alter: migrate tables in place, online: only apply changes that don't rewrite or scan the table, recreate: drop and create the table
+MIGRATION_MODE = "alter"
+if "AUTODLA_MIGRATION_MODE" in os.environ:
+    MIGRATION_MODE = os.environ.get("AUTODLA_MIGRATION_MODE").lower()
+
+# future partitions kept ahead of the current one for partitioned tables
+PARTITIONS_AHEAD = 3
+if "AUTODLA_PARTITIONS_AHEAD" in os.environ:
+    PARTITIONS_AHEAD = int(os.environ.get("AUTODLA_PARTITIONS_AHEAD"))
+
+class MigrationError(Exception):
+    pass
 
 class DB_Connection:
     __data_transformer : DataTransformer
@@ -11,6 +32,11 @@ class DB_Connection:
     def __init__(self, data_transformer, query):
         self.__data_transformer = data_transformer
         self.__query = query
+        self.__unit_of_work = ContextVar(f"autodla_unit_of_work_{id(self)}", default=None)
+        self.__table_definitions = {}
+        self.__table_indexes = {}
+        self.migration_mode = MIGRATION_MODE
+        self.__invalidation_channel = None
 
     @property
     def query(self):
@@ -20,22 +46,146 @@ class DB_Connection:
     def data_transformer(self):
         return self.__data_transformer
     
-    def clean_db(self, DO_NOT_ASK=False):
+    @property
+    def is_async(self) -> bool:
+        return False
+    
+    @property
+    def max_query_params(self) -> int:
+        # most parameters a single statement can take, None when the driver has no limit
+        return None
+
+    @property
+    def in_transaction(self) -> bool:
+        return False
+
+    def begin(self):
+        pass
+
+    def commit(self):
+        pass
+
+    def rollback(self):
+        pass
+
+    def transaction(self) -> Transaction:
+        return Transaction(self)
+
+    @property
+    def unit_of_work(self) -> UnitOfWork:
+        return self.__unit_of_work.get()
+
+    def set_unit_of_work(self, unit_of_work : UnitOfWork):
+        self.__unit_of_work.set(unit_of_work)
+
+    def flush(self) -> Operation:
+        unit_of_work = self.unit_of_work
+        if unit_of_work is not None and unit_of_work.pending:
+            yield from unit_of_work.flush()
+
+    def commit_unit_of_work(self, unit_of_work : UnitOfWork) -> Operation:
+        current = self.unit_of_work
+        if current is not None:
+            current.merge(unit_of_work)
+            return
+        if not unit_of_work.pending:
+            return
+        yield from self.atomic(unit_of_work.flush())
+
+    def atomic(self, operation : Operation) -> Operation:
+        if self.unit_of_work is not None or self.in_transaction:
+            return (yield from operation)
+        yield partial(self.begin)
+        try:
+            out = yield from operation
+        except Exception:
+            yield partial(self.rollback)
+            raise
+        yield partial(self.commit)
+        return out
+    
+    @property
+    def invalidation_channel(self) -> InvalidationChannel:
+        return self.__invalidation_channel
+
+    def set_invalidation_channel(self, channel : InvalidationChannel):
+        channel.subscribe(self.__invalidate)
+        channel.start()
+        self.__invalidation_channel = channel
+
+    def __invalidate(self, class_name, keys):
+        if class_name is None:
+            classes = list(self.__classes.values())
+        else:
+            classes = [self.__classes[class_name]] if class_name in self.__classes else []
+        for class_i in classes:
+            class_i.invalidate_cache(keys)
+
+    def publish_invalidation(self, class_name, keys) -> Operation:
+        if self.__invalidation_channel is None or len(keys) == 0:
+            return
+        yield partial(self.__invalidation_channel.publish, self, class_name, keys)
+
+    def __confirm_clean_db(self, DO_NOT_ASK):
         if not DO_NOT_ASK:
             print("Are you sure you want to clean the database? (y/n)")
             answer = input()
             if answer != "y":
                 raise Exception("User did not confirm the action")
         print("Cleaning database...")
+    
+    def clean_db(self, DO_NOT_ASK=False):
+        self.__confirm_clean_db(DO_NOT_ASK)
         for class_i in self.__classes.values():
             class_i.delete_all()
         print("Database cleaned")
+    
+    async def aclean_db(self, DO_NOT_ASK=False):
+        self.__confirm_clean_db(DO_NOT_ASK)
+        for class_i in self.__classes.values():
+            await class_i.adelete_all()
+        print("Database cleaned")
 
     
-    def get_table_definition(self, table_name) -> dict[str, type]:
-        pass
+    def get_table_definition(self, table_name) -> Operation:
+        return {}
+        yield
+
+    def get_table_definitions(self, table_names : list[str]) -> Operation:
+        out = {}
+        for table_name in table_names:
+            definition = yield from self.get_table_definition(table_name)
+            out[table_name] = {k: {"type": v, "nullable": None} for k, v in definition.items()}
+        return out
+
+    def get_table_indexes(self, table_names : list[str]) -> Operation:
+        return None
+        yield
+
+    def get_table_partitions(self, table_names : list[str]) -> Operation:
+        return None
+        yield
+
+    def load_schema(self, table_names : list[str]) -> Operation:
+        missing = [i for i in table_names if i not in self.__table_definitions]
+        if len(missing) == 0:
+            return
+        definitions = yield from self.get_table_definitions(missing)
+        indexes = yield from self.get_table_indexes(missing)
+        for table_name in missing:
+            self.__table_definitions[table_name] = definitions.get(table_name, {})
+            if indexes is not None:
+                self.__table_indexes[table_name] = indexes.get(table_name, set())
+
+    def invalidate_schema(self, table_name=None):
+        if table_name is None:
+            self.__table_definitions.clear()
+            self.__table_indexes.clear()
+            return
+        self.__table_definitions.pop(table_name, None)
+        self.__table_indexes.pop(table_name, None)
     
-    def attach(self, objects):
+    def __attach(self, objects):
         ordered_objects = []
         pending = objects[:]
         while True:
@@ -54,6 +204,16 @@ class DB_Connection:
         for obj in ordered_objects:
             self.__classes[obj.__name__] = obj
             obj.set_db(self)
+        yield from self.load_schema([name for obj in ordered_objects for table in obj.get_tables() for name in table.table_names])
+        for obj in ordered_objects:
+            for table in obj.get_tables():
+                yield from table.ensure()
+    
+    def attach(self, objects):
+        return run_sync(self.__attach(objects))
+    
+    async def aattach(self, objects):
+        return await run_async(self.__attach(objects))
     
     def get_json_schema(self):
         out = {}
@@ -83,27 +243,185 @@ class DB_Connection:
     def classes(self):
         return self.__classes.values()
 
-    def execute(self, query: str) -> pl.DataFrame:
+    def execute(self, query: Union[Query, str]) -> pl.DataFrame:
         pass
 
-    def normalize_statment(self, statement: str) -> str:
-        if not isinstance(statement, str):
-            statement = str(statement)
-        statement = statement.lstrip().rstrip()
-        if statement[-1] != ";":
-            statement += ";"
-        return statement
+    def open_cursor(self, statement : Union[Query, str]):
+        return {"frame": self.execute(statement), "offset": 0}
+
+    def fetch_cursor(self, cursor, size : int) -> pl.DataFrame:
+        frame = cursor["frame"]
+        if frame is None:
+            return None
+        out = frame.slice(cursor["offset"], size)
+        cursor["offset"] += size
+        return out
+
+    def close_cursor(self, cursor):
+        cursor["frame"] = None
+
+    def copy_in(self, table_name : str, schema : dict, rows : list[dict]):
+        return self.execute(self.query.insert(table_name, rows))
+
+    def normalize_statment(self, statement: Union[Query, str]) -> Query:
+        if not isinstance(statement, Query):
+            statement = Query(str(statement).replace("%", "%%"))
+        st = statement.st.lstrip().rstrip()
+        if st[-1] != ";":
+            st += ";"
+        return Query(st, statement.params, statement.result_schema, statement.limit)
     
-    def ensure_table(self, table_name, schema):
+    def ensure_table(self, table_name, schema, indexes=None, partition_by=None) -> Operation:
+        yield from self.load_schema([table_name])
+        created = yield from self.__ensure_columns(table_name, schema, partition_by)
+        existing_indexes = self.__table_indexes.get(table_name)
+        for index in indexes or []:
+            if existing_indexes is not None and self.query.index_name(table_name, index["columns"], index.get("where")) in existing_indexes:
+                continue
+            yield partial(self.execute, self.query.create_index(table_name, index["columns"], where=index.get("where")))
+            if existing_indexes is not None:
+                existing_indexes.add(self.query.index_name(table_name, index["columns"], index.get("where")))
+        return created == True
+
+    def plan_migration(self, table_name, schema, current_definition) -> list[dict]:
+        steps = []
+        dt = self.data_transformer
+        for k, v in schema.items():
+            field = dt.get_data_field(v["type"])
+            if field is None:
+                continue
+            nullable = v.get("nullable") == True
+            current = current_definition.get(k.upper())
+            if current is None:
+                default = v.get("default")
+                if not nullable and default is None:
+                    raise MigrationError(f"can't add required column '{k}' to {table_name} without a default value, give it a default or make it Optional")
+                qry = self.query.add_column(table_name, k, field.name, not_null=not nullable, default=None if default is None else dt.convert_data(default))
+                steps.append({"query": qry, "online": True})
+                continue
+            if not dt.check_type_compatibilty(v["type"], current["type"]):
+                steps.append({"query": self.query.alter_column_type(table_name, k, field.name), "online": False})
+            if nullable and current["nullable"] == False:
+                steps.append({"query": self.query.drop_not_null(table_name, k), "online": True})
+        columns = [k.upper() for k in schema.keys()]
+        for k, current in current_definition.items():
+            if k not in columns and current["nullable"] == False:
+                steps.append({"query": self.query.drop_not_null(table_name, k.lower()), "online": True})
+        return steps
+
+    def __migrate(self, steps) -> Operation:
+        for step in steps:
+            yield partial(self.execute, step["query"])
+
+    def __ensure_columns(self, table_name, schema, partition_by=None) -> Operation:
+        current_definition = self.__table_definitions[table_name]
+        if len(current_definition) > 0 and self.migration_mode != "recreate":
+            steps = self.plan_migration(table_name, schema, current_definition)
+            if len(steps) == 0:
+                return
+            blocking = [str(step["query"]) for step in steps if not step["online"]]
+            if self.migration_mode == "online" and len(blocking) > 0:
+                raise MigrationError(f"migrating {table_name} rewrites the table, run these statements in a maintenance window:\n" + "\n".join(blocking))
+            self.invalidate_schema(table_name)
+            yield from self.atomic(self.__migrate(steps))
+            yield from self.load_schema([table_name])
+            return
         data_schema = {k.upper(): v["type"] for k, v in schema.items()}
-        current_data_schema = self.get_table_definition(table_name)
+        current_data_schema = {k: v["type"] for k, v in current_definition.items()}
         if all([self.data_transformer.check_type_compatibilty(data_schema.get(k), current_data_schema.get(k)) for k in list(set(data_schema.keys()).union(set(data_schema.keys())))]):
             return
         print(data_schema)
         print(current_data_schema)
         if data_schema == current_data_schema:
             return
-        schema = self.data_transformer.convert_data_schema(schema)
-        self.execute(self.query.drop_table(table_name, if_exists=True))
-        qry = self.query.create_table(table_name, schema)
-        self.execute(qry)
\ No newline at end of file
+        sql_schema = self.data_transformer.convert_data_schema(schema)
+        self.invalidate_schema(table_name)
+        if len(current_definition) > 0:
+            yield partial(self.execute, self.query.drop_table(table_name, if_exists=True))
+        yield partial(self.execute, self.query.create_table(table_name, sql_schema, partition_by=partition_by))
+        self.__table_definitions[table_name] = {k.upper(): {"type": v["type"], "nullable": v.get("nullable") == True} for k, v in schema.items()}
+        self.__table_indexes[table_name] = set()
+        return len(current_definition) == 0
+
+    def __create_partition(self, table_name, partition_name, start=None, end=None) -> Operation:
+        yield partial(self.execute, self.query.create_table_like(partition_name, table_name))
+        if start is not None:
+            # rows written while the range had no partition are waiting in the default one
+            default_name = self.query.partition_name(table_name, "default")
+            columns = list(self.__table_definitions.get(table_name, {}).keys())
+            where = Query(f"{PARTITION_KEY} >= %s AND {PARTITION_KEY} < %s", (self.data_transformer.convert_param(start), self.data_transformer.convert_param(end)))
+            yield partial(self.execute, self.query.move_rows(default_name, partition_name, columns, where))
+        yield partial(self.execute, self.query.attach_partition(table_name, partition_name, start, end))
+
+    def ensure_partitions(self, table_name, interval, ahead=None) -> Operation:
+        partitions = yield from self.get_table_partitions([table_name])
+        if partitions is None:
+            return []
+        if table_name not in partitions:
+            raise MigrationError(f"{table_name} already exists without partitions, it has to be recreated as a table partitioned by {PARTITION_KEY} (or the partition interval removed)")
+        partitions = partitions[table_name]
+        yield from self.load_schema([table_name])
+        created = []
+        default_name = self.query.partition_name(table_name, "default")
+        if (None, None) not in partitions.values():
+            yield from self.atomic(self.__create_partition(table_name, default_name))
+            created.append(default_name)
+        bounds = [v for v in partitions.values() if v != (None, None)]
+        def add(start, end):
+            if any([s < end and start < e for s, e in bounds]):
+                return
+            partition_name = self.query.partition_name(table_name, f"p{start.strftime('%Y%m%d')}")
+            yield from self.atomic(self.__create_partition(table_name, partition_name, start, end))
+            bounds.append((start, end))
+            created.append(partition_name)
+        now = datetime.now()
+        until = partition_start(interval, now)
+        for _ in range(PARTITIONS_AHEAD if ahead is None else ahead):
+            until = partition_end(interval, until)
+        for start, end in partition_ranges(interval, now, until):
+            yield from add(start, end)
+        # older rows that landed in the default partition get the partition of their range
+        while True:
+            res = yield partial(self.execute, self.query.select(default_name, [f"MIN({PARTITION_KEY}) AS since"], limit=None))
+            if res is None or len(res) == 0 or res["since"][0] is None:
+                break
+            start = partition_start(interval, res["since"][0])
+            if any([s <= start < e for s, e in bounds]):
+                break
+            yield from add(start, partition_end(interval, start))
+        return created
+
+    def retire_partitions(self, table_name, older_than : datetime, archive : Callable = None) -> Operation:
+        partitions = yield from self.get_table_partitions([table_name])
+        if partitions is None or table_name not in partitions:
+            return []
+        retired = []
+        for partition_name, (start, end) in sorted(partitions[table_name].items(), key=lambda x: x[1][0] or datetime.min):
+            if start is None or end > older_than:
+                continue
+            # a row that is still current can't be archived, whatever its age
+            res = yield partial(self.execute, self.query.select(partition_name, ["1 AS found"], where="DLA_is_current = TRUE", limit=1))
+            if res is not None and len(res) > 0:
+                continue
+            yield partial(self.execute, self.query.detach_partition(table_name, partition_name))
+            keep = False
+            if archive is not None:
+                keep = (yield partial(archive, partition_name, start, end)) == False
+            if not keep:
+                yield partial(self.execute, self.query.drop_table(partition_name))
+            retired.append(partition_name)
+        return retired
+
+    def __maintain_partitions(self, retention, archive) -> Operation:
+        out = {"created": [], "retired": []}
+        for class_i in self.__classes.values():
+            res = yield from class_i.partition_maintenance(retention, archive)
+            out["created"] += res["created"]
+            out["retired"] += res["retired"]
+        return out
+
+    def maintain_partitions(self, retention=None, archive : Callable = None) -> dict:
+        return run_sync(self.__maintain_partitions(retention, archive))
+
+    async def amaintain_partitions(self, retention=None, archive : Callable = None) -> dict:
+        return await run_async(self.__maintain_partitions(retention, archive))
@@ -1,10 +1,21 @@
 import ast
 import inspect
-from dataclasses import dataclass
+import os
+import re
+from collections import ChainMap
+from dataclasses import dataclass, field
 from typing import Any, Callable
+from autodla.engine.cache import LRUCache
 from autodla.engine.data_conversion import DataTransformer, MethodArgument
+from autodla.engine.query_builder import Query
 from datetime import datetime
 
+FILTER_CACHE_SIZE = 512
+if "AUTODLA_FILTER_CACHE_SIZE" in os.environ:
+    FILTER_CACHE_SIZE = int(os.environ.get("AUTODLA_FILTER_CACHE_SIZE"))
+
+SLOT_PATTERN = re.compile(r'%%|%\(s(\d+)\)s')
+
 class LambdaFinder(ast.NodeVisitor):
     def __init__(self): 
         self.found = None
@@ -55,9 +66,23 @@ class LambdaToSql(ast.NodeVisitor):
         self.root = root
         self.data_transformer = data_transformer
         self.alias = alias
+        self.slots = []
+        self.structural_names = set()
+        self.marks = []
+        self.cacheable = True
+    
+    def slot(self, value, name=None, expression=None):
+        self.slots.append((name, value, expression))
+        return f'%(s{len(self.slots) - 1})s'
+    
+    def mark_structural(self, node):
+        for child in ast.walk(node):
+            if isinstance(child, ast.Name):
+                self.structural_names.add(child.id)
     
     def evaluate_node(self, node):
-        return eval(str(ast.unparse(node)), self.ctx_vars)
+        self.mark_structural(node)
+        return eval(str(ast.unparse(node)), dict(self.ctx_vars))
     
     def repr(self, obj):
         st = repr(obj)
@@ -74,8 +99,21 @@ class LambdaToSql(ast.NodeVisitor):
         return ast.parse(st).body[0].value
 
     def evaluate_and_parse_node(self, node):
-        out = self.obj_to_node(self.evaluate_node(node))
-        return self.parse_node(out)
+        return self.evaluated(node, self.evaluate_node(node))
+
+    def evaluated(self, node, value):
+        try:
+            self.data_transformer.convert_data(value)
+        except TypeError:
+            # the SQL is built from the value itself, it can't be reused for other calls
+            self.cacheable = False
+            return self.parse_node(self.obj_to_node(value))
+        if not any([isinstance(child, ast.Name) for child in ast.walk(node)]):
+            return NodeReturn(self.slot(value), type(value), value)
+        # computed from captured variables, evaluated again on every call so changes to them are seen
+        self.structural_names = self.marks[-1]
+        expression = compile(ast.unparse(node), '<filter>', 'eval')
+        return NodeReturn(self.slot(value, expression=expression), type(value), value)
     
     def node_compatibility(self, node1 : NodeReturn, node2: NodeReturn):
         if isinstance(node1, type(node2)) or isinstance(node2, type(node1)):
@@ -91,17 +129,28 @@ class LambdaToSql(ast.NodeVisitor):
         return False
 
     def parse_node(self, node):
+        # names marked before this node, an evaluated node only shapes the SQL through its value
+        self.marks.append(set(self.structural_names))
+        try:
+            return self.parse_expression(node)
+        finally:
+            self.marks.pop()
+
+    def parse_expression(self, node):
         match type(node).__name__:
             case 'Subscript':
                 caller = self.parse_node(node.value)
                 slice_node = self.parse_node(node.slice)
                 attr = slice_node.st if slice_node.eval is None else slice_node.eval
+                if slice_node.eval is not None:
+                    self.mark_structural(node.slice)
                 if caller.eval is None:
                     if attr not in self.schema:
                         raise AttributeError(f"invalid attribute for {caller.st}: '{node.attr}'")
                     return NodeReturn(f'{caller.st}.{attr}', self.schema.get(attr))
                 if slice_node.eval is None:
                     raise ValueError(f'invalid slice node: {slice_node.st}')
+                self.mark_structural(node.value)
                 val = getattr(caller.eval, slice_node.eval)
                 if val is None:
                     raise AttributeError(f"attribute not found: '{node.attr}'")
@@ -137,9 +186,8 @@ class LambdaToSql(ast.NodeVisitor):
                         if isinstance(f, Callable):
                             func = f
                         if type(f) == type(int) and all([arg.eval is not None for arg in args]):
-                            res = f(*[arg.eval for arg in args])
-                            n = self.obj_to_node(res)
-                            return self.parse_node(self.obj_to_node(res))
+                            self.mark_structural(node)
+                            return self.evaluated(node, f(*[arg.eval for arg in args]))
                             
                 
                 if func is not None and all([arg.eval is not None for arg in args]):
@@ -204,14 +252,17 @@ class LambdaToSql(ast.NodeVisitor):
                 value = self.ctx_vars.get(node.id)
                 if value is not None:
                     try:
-                        transformed_value = self.data_transformer.convert_data(value)
+                        self.data_transformer.convert_data(value)
+                        transformed_value = self.slot(value, node.id)
                     except:
+                        self.structural_names.add(node.id)
                         transformed_value = node.id
                     return NodeReturn(transformed_value, type(value), value)
                 raise ValueError(f"'{node.id}' is not defined")
             case 'Constant':
+                self.data_transformer.convert_data(node.value)
                 return NodeReturn(
-                    self.data_transformer.convert_data(node.value),
+                    self.slot(node.value),
                     type(node.value),
                     node.value
                 )
@@ -232,6 +283,7 @@ class LambdaToSql(ast.NodeVisitor):
                     if node.attr not in self.schema:
                         raise AttributeError(f"invalid attribute for x: '{node.attr}'")
                     return NodeReturn(f'{self.parse_node(node.value).st}.{node.attr}', self.schema.get(node.attr))
+                self.mark_structural(node.value)
                 val = getattr(caller.eval, node.attr)
                 if val is None:
                     raise AttributeError(f"attribute not found: '{node.attr}'")
@@ -240,9 +292,7 @@ class LambdaToSql(ast.NodeVisitor):
                 return self.evaluate_and_parse_node(node)
             case _:
                 try:
-                    evaluation = self.evaluate_node(node)
-                    new_node=ast.Constant(value=evaluation)
-                    return self.parse_node(new_node)
+                    return self.evaluate_and_parse_node(node)
                 except:
                     print(ast.dump(node))
                     raise ValueError(f'Invalid node type: {type(node).__name__}')
@@ -261,23 +311,103 @@ class LambdaToSql(ast.NodeVisitor):
 
 import builtins
 def get_context_from_lamba(lambda_func):
-    file = lambda_func.__code__.co_filename
-    line = lambda_func.__code__.co_firstlineno
-    found = None
-    for frame in inspect.stack():
-        if frame.filename == file and frame.lineno == line:
-            found = frame
-            break
-    if found is None:
-        raise ValueError('frame not found')
-    return {**vars(builtins), **found.frame.f_locals}
+    closure_vars = {}
+    if lambda_func.__closure__:
+        for name, cell in zip(lambda_func.__code__.co_freevars, lambda_func.__closure__):
+            try:
+                closure_vars[name] = cell.cell_contents
+            except ValueError:
+                pass
+    return ChainMap(closure_vars, lambda_func.__globals__, vars(builtins))
+
+_MISSING = object()
+
+def _same_value(v1, v2):
+    try:
+        return type(v1) == type(v2) and bool(v1 == v2)
+    except Exception:
+        return False
 
-def lambda_to_sql(schema, lambda_func, data_transformer : DataTransformer, ctx_vars={}, alias='x') -> str:
-    if not type(lambda_func) == str:
+@dataclass
+class FilterTemplate:
+    st: str
+    slots: list
+    schema: dict
+    lambda_node: ast.Lambda
+    slot_types: dict = field(default_factory=dict)
+    structural_values: dict = field(default_factory=dict)
+    cacheable: bool = True
+
+    @classmethod
+    def compile(cls, lambda_node, schema, data_transformer, ctx_vars, alias):
+        transformer = LambdaToSql(lambda_node, schema, data_transformer=data_transformer, ctx_vars=ctx_vars, alias=alias)
+        out = transformer.transform()
+        template = cls(out.st, transformer.slots, schema, lambda_node, cacheable=transformer.cacheable)
+        for name, value, _ in transformer.slots:
+            if name is not None:
+                template.slot_types[name] = type(value)
+        for name in transformer.structural_names:
+            template.structural_values[name] = ctx_vars.get(name, _MISSING)
+        return template
+
+    def values(self, ctx_vars) -> list:
+        # None when an expression can't be evaluated with these variables, compiling again reports the error
+        out = []
+        scope = None
+        for name, value, expression in self.slots:
+            if expression is not None:
+                if scope is None:
+                    scope = dict(ctx_vars)
+                try:
+                    value = eval(expression, scope)
+                except Exception:
+                    return None
+            elif name is not None:
+                value = ctx_vars.get(name)
+            out.append(value)
+        return out
+
+    def matches(self, schema, ctx_vars, values):
+        if not self.cacheable or schema is not self.schema or values is None:
+            return False
+        for name, tp in self.slot_types.items():
+            if type(ctx_vars.get(name)) is not tp:
+                return False
+        for (_, value, expression), current in zip(self.slots, values):
+            if expression is not None and type(current) is not type(value):
+                return False
+        for name, value in self.structural_values.items():
+            if not _same_value(ctx_vars.get(name, _MISSING), value):
+                return False
+        return True
+
+    def bind(self, values, data_transformer : DataTransformer) -> Query:
+        params = []
+        def replace(match):
+            if match.group(1) is None:
+                return match.group(0)
+            params.append(data_transformer.convert_param(values[int(match.group(1))]))
+            return data_transformer.PLACEHOLDER
+        st = SLOT_PATTERN.sub(replace, self.st)
+        return Query(st, tuple(params))
+
+_filter_cache = LRUCache(FILTER_CACHE_SIZE)
+
+def lambda_to_sql(schema, lambda_func, data_transformer : DataTransformer, ctx_vars={}, alias='x') -> Query:
+    if type(lambda_func) == str:
+        key = lambda_func
+    else:
+        key = lambda_func.__code__
         ctx_vars = get_context_from_lamba(lambda_func)
-    lambda_node = lambda_to_ast(lambda_func)
-    out = LambdaToSql(lambda_node, schema, data_transformer=data_transformer, ctx_vars=ctx_vars, alias=alias).transform()
-    return out.st
+    cache_key = (key, alias, id(schema), type(data_transformer))
+    template = _filter_cache.get(cache_key)
+    values = None if template is None else template.values(ctx_vars)
+    if template is None or not template.matches(schema, ctx_vars, values):
+        lambda_node = template.lambda_node if template is not None else lambda_to_ast(lambda_func)
+        template = FilterTemplate.compile(lambda_node, schema, data_transformer, ctx_vars, alias)
+        _filter_cache.put(cache_key, template)
+        values = [value if name is None else ctx_vars.get(name) for name, value, _ in template.slots]
+    return template.bind(values, data_transformer)
 
 def json_to_lambda_str(json_condition):
     """
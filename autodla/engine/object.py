@@ -1,16 +1,49 @@
 from dataclasses import field, _MISSING_TYPE
-from datetime import datetime
+from datetime import datetime, timedelta
+from functools import partial
+from itertools import count, islice
 from types import NoneType
-from typing import List, Union, get_origin, ClassVar, Literal, get_args, TypeVar, Any
+import base64
+import json
+import time
+from typing import List, Optional, Union, get_origin, ClassVar, Literal, get_args, TypeVar, Any
 import uuid
+import weakref
 import polars as pl
+from autodla.engine.cache import IdentityMap
 from autodla.engine.db import DB_Connection
 from autodla.engine.lambda_conversion import lambda_to_sql
-from pydantic import BaseModel, GetCoreSchemaHandler, TypeAdapter
+from autodla.engine.operation import run_async, run_sync
+from autodla.engine.partitioning import PARTITION_INTERVALS, PARTITION_KEY
+from autodla.engine.query_builder import Query
+from autodla.engine.unit_of_work import UnitOfWork
+from pydantic import BaseModel, GetCoreSchemaHandler, PrivateAttr, TypeAdapter
 from pydantic_core import CoreSchema, core_schema, PydanticUndefinedType
+import os
 import warnings
 warnings.filterwarnings('error')
 
+CACHE_TTL = 0
+if "AUTODLA_CACHE_TTL" in os.environ:
+	CACHE_TTL = float(os.environ.get("AUTODLA_CACHE_TTL"))
+IDENTITY_MAP_SIZE = 1024
+if "AUTODLA_IDENTITY_MAP_SIZE" in os.environ:
+	IDENTITY_MAP_SIZE = int(os.environ.get("AUTODLA_IDENTITY_MAP_SIZE"))
+ITER_BATCH_SIZE = 1000
+if "AUTODLA_ITER_BATCH_SIZE" in os.environ:
+	ITER_BATCH_SIZE = int(os.environ.get("AUTODLA_ITER_BATCH_SIZE"))
+# single: every version in one table, split: current rows in the table and superseded ones in an append-only history table
+STORAGE_LAYOUT = "single"
+if "AUTODLA_STORAGE_LAYOUT" in os.environ:
+	STORAGE_LAYOUT = os.environ.get("AUTODLA_STORAGE_LAYOUT").lower()
+# day, week, month or year: range partition the tables that keep history by DLA_modified_at
+PARTITION_INTERVAL = None
+if "AUTODLA_PARTITION_INTERVAL" in os.environ:
+	PARTITION_INTERVAL = os.environ.get("AUTODLA_PARTITION_INTERVAL").lower() or None
+BULK_LOAD_BATCH_SIZE = 10000
+if "AUTODLA_BULK_LOAD_BATCH_SIZE" in os.environ:
+	BULK_LOAD_BATCH_SIZE = int(os.environ.get("AUTODLA_BULK_LOAD_BATCH_SIZE"))
+
 from json import JSONEncoder
 def _default(self, obj):
 	return getattr(obj.__class__, "to_json", _default.default)(obj)
@@ -44,7 +77,9 @@ class primary_key(str):
 	def __hash__(self):
 		return super().__hash__()
 
-def dla_dict(operation : Literal["INSERT", "UPDATE", "DELETE"], modified_at=datetime.now(), modified_by="SYSTEM", is_current=False, is_active=True):
+def dla_dict(operation : Literal["INSERT", "UPDATE", "DELETE"], modified_at=None, modified_by="SYSTEM", is_current=False, is_active=True):
+	if modified_at is None:
+		modified_at = datetime.now()
 	def out():
 		return {
 			'DLA_object_id': primary_key.generate(),
@@ -56,10 +91,30 @@ def dla_dict(operation : Literal["INSERT", "UPDATE", "DELETE"], modified_at=date
 		}
 	return out
 
+CURRENT_CONDITION = "DLA_is_current AND DLA_is_active"
+# every row written, in the order it was written
+CHANGE_ORDERING = [("DLA_modified_at", False), ("DLA_object_id", False)]
+
+# the moment of a point-in-time read, bound once as a parameter so the statement text doesn't change with it
+AS_OF = "(SELECT moment FROM dla_as_of)"
+
+def audit_indexes(key_field : str, current_fields : list[str] = []) -> list[dict]:
+	out = [
+		{"columns": [key_field], "where": CURRENT_CONDITION},
+		{"columns": [key_field, "DLA_modified_at"]}
+	]
+	for field in current_fields:
+		out.append({"columns": [field], "where": CURRENT_CONDITION})
+	return out
+
 class Table:
-	def __init__(self, table_name : str, schema : dict, db : DB_Connection = None):
+	def __init__(self, table_name : str, schema : dict, db : DB_Connection = None, indexes : list[dict] = None, split_history = False, partition_interval = None):
 		self.table_name = "public." + table_name
+		self.history_table_name = self.table_name + "__history" if split_history else None
+		self.partition_interval = partition_interval
 		self.schema = schema
+		self.indexes = indexes or []
+		self.__db = None
 		if db:
 			self.set_db(db)
 	
@@ -74,72 +129,250 @@ class Table:
 		if db is None:
 			raise ValueError("DB not defined")
 		self.__db = db
-		self.__db.ensure_table(self.table_name, self.schema)
 		self.__table_alias = "".join(self.table_name.split('.'))
 	
-	def get_all(self, limit=10, only_current=True, only_active=True):
+	@property
+	def alias(self) -> str:
+		return self.__table_alias
+	
+	@property
+	def table_names(self) -> list[str]:
+		if self.history_table_name is None:
+			return [self.table_name]
+		return [self.table_name, self.history_table_name]
+	
+	def source(self, only_current=True) -> str:
+		if self.history_table_name is None or only_current:
+			return self.table_name
+		columns = ", ".join(self.schema.keys())
+		return f"(SELECT {columns} FROM {self.table_name} UNION ALL SELECT {columns} FROM {self.history_table_name})"
+	
+	@property
+	def partitioned_table_name(self) -> str:
+		# the table that keeps the history is the one that grows, with the split layout current rows stay unpartitioned
+		if self.partition_interval is None:
+			return None
+		return self.history_table_name or self.table_name
+	
+	def ensure(self):
+		partition_by = None if self.partition_interval is None else PARTITION_KEY
+		if self.history_table_name is None:
+			yield from self.db.ensure_table(self.table_name, self.schema, self.indexes, partition_by=partition_by)
+		else:
+			yield from self.db.ensure_table(self.table_name, self.schema, [i for i in self.indexes if i.get("where") or i.get("all_rows")])
+			created = yield from self.db.ensure_table(self.history_table_name, self.schema, [i for i in self.indexes if not i.get("where")], partition_by=partition_by)
+			if created:
+				# superseded rows written with the single table layout
+				yield from self.db.atomic(self.__move_to_history(Query("DLA_is_current = false")))
+		yield from self.maintain_partitions()
+	
+	def maintain_partitions(self, older_than : datetime = None, archive = None):
+		out = {"created": [], "retired": []}
+		if self.partition_interval is None:
+			return out
+		out["created"] = yield from self.db.ensure_partitions(self.partitioned_table_name, self.partition_interval)
+		if older_than is not None:
+			out["retired"] = yield from self.db.retire_partitions(self.partitioned_table_name, older_than, archive)
+		return out
+	
+	def __move_to_history(self, where):
+		qry = self.db.query.move_rows(self.table_name, self.history_table_name, list(self.schema.keys()), where, {'DLA_is_current': False})
+		yield partial(self.db.execute, qry)
+	
+	def __conditions(self, l_func, only_current, only_active):
 		conditions = ["TRUE"]
+		if l_func is not None:
+			conditions = [lambda_to_sql(self.schema, l_func, self.__db.data_transformer, alias=self.__table_alias)]
 		if only_current:
 			conditions.append("DLA_is_current = true")
 		if only_active:
 			conditions.append("DLA_is_active = true")
-		where_st = " AND ".join(conditions)
-		qry = self.db.query.select(
-			from_table=f'{self.table_name} {self.__table_alias}',
-			columns=[f'{self.__table_alias}.{i}' for i in list(self.schema.keys())],
-			where=where_st,
-			limit=limit
-		)
-		return self.db.execute(qry)
+		return conditions
 	
-	def filter(self, l_func, limit=10, only_current=True, only_active=True):
-		conditions = [lambda_to_sql(self.schema, l_func, self.__db.data_transformer, alias=self.__table_alias)]
-		if only_current:
-			conditions.append("DLA_is_current = true")
-		if only_active:
-			conditions.append("DLA_is_active = true")
-		where_st = " AND ".join(conditions)
+	def __keyset(self, order_by, after):
+		# rows strictly after `after` in the `order_by` order, NULLs go last ascending (and first descending) like in Postgres
+		dt = self.db.data_transformer
+		def param(k):
+			# compared as the column type, an untyped float8 parameter never equals the REAL it came from
+			field = dt.get_data_field(self.schema[k]["type"])
+			return dt.PLACEHOLDER if field is None or not field.name else f"CAST({dt.PLACEHOLDER} AS {field.name})"
+		def beyond(k, desc, value):
+			column = f'{self.__table_alias}.{k}'
+			if value is None:
+				return Query(f"{column} IS NOT NULL" if desc else "FALSE")
+			if desc:
+				return Query(f"{column} < {param(k)}", (dt.convert_param(value),))
+			return Query(f"({column} > {param(k)} OR {column} IS NULL)", (dt.convert_param(value),))
+		def equal(k, value):
+			column = f'{self.__table_alias}.{k}'
+			if value is None:
+				return Query(f"{column} IS NULL")
+			return Query(f"{column} = {param(k)}", (dt.convert_param(value),))
+		clauses = []
+		for i, (k, desc) in enumerate(order_by):
+			parts = [equal(order_by[j][0], after[j]) for j in range(i)]
+			clause = Query.join(" AND ", parts + [beyond(k, desc, after[i])])
+			clauses.append(Query(f"({clause.st})", clause.params))
+		out = Query.join(" OR ", clauses)
+		return Query(f"({out.st})", out.params)
+	
+	def snapshot(self, as_of : str, key_columns : list[str], where : str = None) -> str:
+		# latest version of each key written up to the `as_of` SQL expression, deleted ones included so the caller can leave them out
+		keys = ", ".join(key_columns)
+		conditions = [f"DLA_modified_at <= {as_of}"] + ([where] if where else [])
+		return f"(SELECT DISTINCT ON ({keys}) {', '.join(self.schema.keys())} FROM {self.source(False)} dla_v WHERE {' AND '.join(conditions)} ORDER BY {keys}, DLA_modified_at DESC)"
+	
+	def __select_query(self, conditions, limit, order_by=None, after=None, related=None, columns=None, only_current=True, source=None, as_of=None):
+		if after is not None:
+			conditions = conditions + [self.__keyset(order_by, after)]
+		related = related or {}
+		schema = self.schema if columns is None else {k: self.schema[k] for k in columns}
 		qry = self.db.query.select(
-			from_table=f'{self.table_name} {self.__table_alias}',
-			columns=[f'{self.__table_alias}.{i}' for i in list(self.schema.keys())],
-			where=where_st,
-			limit=limit
+			from_table=f'{source or self.source(only_current)} {self.__table_alias}',
+			columns=[f'{self.__table_alias}.{i}' for i in list(schema.keys())] + [f'({v})::text AS {k}' for k, v in related.items()],
+			where=Query.join(" AND ", conditions),
+			limit=limit,
+			order_by=", ".join([f"{self.__table_alias}.{k} {'DESC' if desc else 'ASC'}" for k, desc in order_by or []])
 		)
-		return self.db.execute(qry)
+		if as_of is not None:
+			dt = self.db.data_transformer
+			qry = Query(f"WITH dla_as_of AS (SELECT CAST({dt.PLACEHOLDER} AS {dt.get_data_field(datetime).name}) AS moment) {qry.st}", (dt.convert_param(as_of),) + qry.params, limit=qry.limit)
+		qry.result_schema = {**{k: v["type"] for k, v in schema.items()}, **{k: str for k in related.keys()}}
+		return qry
+	
+	def open_cursor(self, l_func=None, only_current=True, only_active=True, related=None):
+		yield from self.db.flush()
+		qry = self.__select_query(self.__conditions(l_func, only_current, only_active), None, related=related, only_current=only_current)
+		return (yield partial(self.db.open_cursor, qry))
+	
+	def get_all(self, limit=10, only_current=True, only_active=True, order_by=None, after=None, related=None, columns=None, source=None, as_of=None):
+		yield from self.db.flush()
+		qry = self.__select_query(self.__conditions(None, only_current, only_active), limit, order_by, after, related, columns, only_current, source, as_of)
+		return (yield partial(self.db.execute, qry))
+	
+	def filter(self, l_func, limit=10, only_current=True, only_active=True, order_by=None, after=None, related=None, columns=None, source=None, as_of=None, flush=True):
+		if flush:
+			yield from self.db.flush()
+		qry = self.__select_query(self.__conditions(l_func, only_current, only_active), limit, order_by, after, related, columns, only_current, source, as_of)
+		return (yield partial(self.db.execute, qry))
 	
 	def insert(self, data : dict):
-		qry = self.db.query.insert(self.table_name, [data])
-		self.db.execute(qry)
-	
-	def update(self, l_func, data):
-		where_st = lambda_to_sql(self.schema, l_func, self.__db.data_transformer, alias=self.__table_alias)
-		update_data = {f'{key}': value for key, value in data.items()}
-		qry = self.db.query.update(
-			f'{self.table_name} {self.__table_alias}',
-			where=where_st,
-			values=update_data
+		yield from self.insert_many([data])
+	
+	def __batches(self, items : list, width : int) -> list[list]:
+		# split so each statement stays under the parameter limit of the driver
+		limit = self.db.max_query_params
+		if limit is None:
+			return [items]
+		size = max(1, limit // max(1, width))
+		return [items[i:i + size] for i in range(0, len(items), size)]
+	
+	def __insert_rows(self, table_name, rows):
+		if len(rows) == 0:
+			return
+		for batch in self.__batches(rows, len(rows[0])):
+			yield partial(self.db.execute, self.db.query.insert(table_name, batch))
+	
+	def insert_many(self, data : list[dict]):
+		if self.history_table_name is not None:
+			yield from self.__insert_rows(self.history_table_name, [row for row in data if row.get("DLA_is_current") == False])
+			data = [row for row in data if row.get("DLA_is_current") != False]
+		yield from self.__insert_rows(self.table_name, data)
+	
+	def get_version(self, key_field : str, key):
+		yield from self.db.flush()
+		dt = self.db.data_transformer
+		qry = self.db.query.select(
+			from_table=self.table_name,
+			columns=["DLA_object_id"],
+			where=Query(f"{key_field} = {dt.PLACEHOLDER} AND DLA_is_current = true AND DLA_is_active = true", (dt.convert_param(key),)),
+			limit=1
 		)
-		return self.db.execute(qry)
+		res = yield partial(self.db.execute, qry)
+		if res is None or len(res) == 0:
+			return None
+		return str(res[0, 0])
+	
+	def supersede(self, columns : tuple, keys : list[tuple]):
+		if len(keys) == 0:
+			return
+		dt = self.db.data_transformer
+		if len(columns) == 1:
+			target = columns[0]
+			keys = [key[0] for key in keys]
+			# a flat IN list is sent as a single parameter
+			batches = [list(keys)]
+		else:
+			target = f"({', '.join(columns)})"
+			batches = self.__batches(list(keys), len(columns))
+		for batch in batches:
+			where_st = Query(f"{target} IN {dt.PLACEHOLDER} AND DLA_is_current = true", (dt.convert_param(batch),))
+			if self.history_table_name is not None:
+				yield from self.__move_to_history(where_st)
+				continue
+			qry = self.db.query.update(self.table_name, where=where_st, values={'DLA_is_current': False})
+			yield partial(self.db.execute, qry)
+	
+	def copy_in(self, rows : list[dict]):
+		if len(rows) == 0:
+			return
+		yield from self.db.flush()
+		yield partial(self.db.copy_in, self.table_name, {k: v["type"] for k, v in self.schema.items()}, rows)
+	
+	def apply_changes(self, superseded : dict, rows : list[dict]):
+		for columns, keys in superseded.items():
+			yield from self.supersede(columns, keys)
+		yield from self.insert_many(rows)
 	
 	def delete_all(self):
-		qry = self.db.query.delete(self.table_name, "TRUE")
-		self.db.execute(qry)
+		yield from self.db.flush()
+		for table_name in self.table_names:
+			qry = self.db.query.delete(table_name, "TRUE")
+			yield partial(self.db.execute, qry)
+
+class LazyRelation:
+	# a relationship left unloaded for every object of the same query, resolved for all of them on first access
+	def __init__(self, field_name : str, objects : list):
+		self.field_name = field_name
+		self.objects = [weakref.ref(obj) for obj in objects]
+
+	def pending(self) -> list:
+		out = []
+		for ref in self.objects:
+			obj = ref()
+			if obj is not None and obj._dla_lazy.get(self.field_name) is self:
+				out.append(obj)
+		return out
 
 class Object(BaseModel):
 	__table : ClassVar[Table] = None
 	__dependencies : ClassVar[list] = []
+	__field_adapters : ClassVar[dict] = {}
 	identifier_field : ClassVar[str] = "id"
-	__objects_list : ClassVar[List] = []
-	__objects_map : ClassVar[dict] = {}
+	indexed_fields : ClassVar[list[str]] = []
+	lazy_fields : ClassVar[list[str]] = []
+	identity_map_size : ClassVar[int] = IDENTITY_MAP_SIZE
+	cache_ttl : ClassVar[float] = CACHE_TTL
+	storage_layout : ClassVar[Literal["single", "split"]] = STORAGE_LAYOUT
+	partition_interval : ClassVar[Optional[Literal["day", "week", "month", "year"]]] = PARTITION_INTERVAL
+	_dla_version : Optional[str] = PrivateAttr(default=None)
+	_dla_loaded_at : float = PrivateAttr(default=0.0)
+	_dla_lazy : dict = PrivateAttr(default_factory=dict)
+	_dla_state : dict = PrivateAttr(default_factory=dict)
+	__objects_map : ClassVar[IdentityMap] = None
 
 	@classmethod
-	def delete_all(cls):
-		cls.__objects_list = []
-		cls.__objects_map = {}
-		cls.__table.delete_all()
+	def __delete_all(cls):
+		cls.__objects_map.clear()
+		yield from cls.__table.delete_all()
 
 	@classmethod
 	def set_db(cls, db : DB_Connection):
+		if cls.storage_layout not in ["single", "split"]:
+			raise ValueError(f"unknown storage layout '{cls.storage_layout}' for {cls.__name__}, use 'single' or 'split'")
+		split_history = cls.storage_layout == "split"
+		if cls.partition_interval is not None and cls.partition_interval not in PARTITION_INTERVALS:
+			raise ValueError(f"unknown partition interval '{cls.partition_interval}' for {cls.__name__}, use one of {', '.join(PARTITION_INTERVALS)}")
 		schema = cls.get_types()
 		dependencies = {}
 		common_fields = {
@@ -186,7 +419,10 @@ class Object(BaseModel):
 							}
 							,**common_fields
 						},
-						db
+						db,
+						audit_indexes("first_id", ["second_id"]),
+						split_history,
+						cls.partition_interval
 					)
 				}
 			elif 'is_list' in i:
@@ -212,13 +448,58 @@ class Object(BaseModel):
 							}
 							,**common_fields
 						},
-						db
+						db,
+						audit_indexes("first_id"),
+						split_history,
+						cls.partition_interval
 					)
 				}
 		for i in dependencies:
 			del schema[i]
-		cls.__table = Table(cls.__name__.lower(), {**schema,**common_fields}, db)
+		for i in cls.indexed_fields:
+			if i not in schema:
+				raise ValueError(f"indexed field '{i}' is not a column of {cls.__name__}")
+		for i in cls.lazy_fields:
+			if i not in dependencies or dependencies[i]['is_value']:
+				raise ValueError(f"lazy field '{i}' is not a relationship of {cls.__name__}")
+		# all_rows: with the split layout the index is also built on the current table, changes_since reads both
+		indexes = audit_indexes(cls.identifier_field, cls.indexed_fields) + [{"columns": [k for k, _ in CHANGE_ORDERING], "all_rows": True}]
+		cls.__table = Table(cls.__name__.lower(), {**schema,**common_fields}, db, indexes, split_history, cls.partition_interval)
+		cls.__objects_map = IdentityMap(cls.identity_map_size)
 		cls.__dependencies = dependencies
+		cls.__field_adapters = {k: TypeAdapter(v.annotation) for k, v in cls.model_fields.items() if k not in dependencies or dependencies[k]['is_value']}
+
+	@classmethod
+	def get_tables(cls) -> list[Table]:
+		return [cls.__table] + [v['table'] for v in cls.__dependencies.values()]
+
+	@classmethod
+	def partition_maintenance(cls, retention : timedelta = None, archive = None):
+		older_than = None if retention is None else datetime.now() - retention
+		out = {"created": [], "retired": []}
+		for table in cls.get_tables():
+			res = yield from table.maintain_partitions(older_than, archive)
+			out["created"] += res["created"]
+			out["retired"] += res["retired"]
+		return out
+
+	@classmethod
+	def maintain_partitions(cls, retention : timedelta = None, archive = None) -> dict:
+		return run_sync(cls.partition_maintenance(retention, archive))
+
+	@classmethod
+	async def amaintain_partitions(cls, retention : timedelta = None, archive = None) -> dict:
+		return await run_async(cls.partition_maintenance(retention, archive))
+
+	@classmethod
+	def identity_map_info(cls) -> dict:
+		if cls.__objects_map is None:
+			raise ImportError('DB not defined')
+		return cls.__objects_map.info()
+
+	@classmethod
+	def is_async(cls) -> bool:
+		return cls.__table.db.is_async
 
 	@classmethod
 	def get_types(cls):
@@ -254,262 +535,783 @@ class Object(BaseModel):
 		return out
 	
 	@classmethod
-	def __update_individual(cls, data_inp):
+	def __update_individual(cls, data_inp, detached=False):
 		print("UPDATE INDIVIDUAL", cls, data_inp)
 		data = {}
 		for k, v in data_inp.items():
 			if not k.upper().startswith("DLA_"):
 				data[k] = v
-		found = cls.__objects_map.get(data[cls.identifier_field])
+		found = None if detached else cls.__objects_map.get(str(data[cls.identifier_field]))
+		lazy = [k for k in cls.__dependencies if k not in data]
 		try:
-			cls.model_validate(data)
+			if len(lazy) == 0:
+				validated = cls.model_validate(data)
+				values = {k: validated.__dict__[k] for k in data}
+			else:
+				values = {k: cls.__field_adapters[k].validate_python(v) if k in cls.__field_adapters else v for k, v in data.items()}
 		except Exception as e:
 			print(e)
 			return None
-		if found is not None:
-			found.__dict__.update(data)
-			return found
-		obj = cls(**data)
-		cls.__objects_list.append(obj)
-		cls.__objects_map[obj[cls.identifier_field]] = obj
-		return obj
+		if found is None:
+			if len(lazy) == 0:
+				found = validated
+			else:
+				found = cls.model_construct(**values)
+				for k in lazy:
+					found.__dict__.pop(k, None)
+			if not detached:
+				cls.__objects_map.put(str(found[cls.identifier_field]), found)
+		else:
+			found.__dict__.update(values)
+		for k in data:
+			found._dla_lazy.pop(k, None)
+		found.__remember(data)
+		found.__loaded(data_inp.get('dla_object_id'))
+		return found
+
+	def __loaded(self, version):
+		self._dla_version = None if version is None else str(version)
+		self._dla_loaded_at = time.monotonic()
+
+	@classmethod
+	def invalidate_cache(cls, keys : list[str] = None):
+		if cls.__objects_map is None:
+			return
+		if keys is None:
+			objects = cls.__objects_map.values()
+		else:
+			objects = [cls.__objects_map.peek(str(key)) for key in keys]
+		for obj in objects:
+			if obj is not None:
+				obj._dla_version = None
 	
 	@classmethod
-	def __update_info(cls, filter = None, limit=10, only_current=True, only_active=True):
+	def __ordering(cls, order_by):
+		if order_by is None:
+			order_by = []
+		if isinstance(order_by, str):
+			order_by = order_by.split(",")
+		out = []
+		for field_name in order_by:
+			field_name = field_name.strip()
+			desc = field_name.startswith("-")
+			field_name = field_name.lstrip("-")
+			if field_name not in cls.__table.schema or field_name not in cls.model_fields:
+				raise ValueError(f"can't order {cls.__name__} by '{field_name}'")
+			out.append((field_name, desc))
+		# the identifier breaks ties so the order is total and pages don't overlap
+		if cls.identifier_field not in [k for k, _ in out]:
+			out.append((cls.identifier_field, False))
+		return out
+
+	@classmethod
+	def __decode_cursor(cls, ordering, after):
+		try:
+			values = json.loads(base64.urlsafe_b64decode(after.encode()))
+			if len(values) != len(ordering):
+				raise ValueError()
+			return [None if v is None else TypeAdapter(cls.__table.schema[k]["type"]).validate_python(v) for (k, _), v in zip(ordering, values)]
+		except ValueError:
+			raise ValueError(f"invalid cursor for {cls.__name__}")
+
+	@classmethod
+	def next_cursor(cls, objects : list["Object"], order_by=None) -> str:
+		if len(objects) == 0:
+			return None
+		last = objects[-1]
+		return cls.__encode_cursor([last[k] for k, _ in cls.__ordering(order_by)])
+
+	@staticmethod
+	def __encode_cursor(values):
+		return base64.urlsafe_b64encode(json.dumps(values, default=str).encode()).decode()
+
+	@classmethod
+	def change_cursor(cls, change : dict) -> str:
+		# rows written together share DLA_modified_at, the object id tells them apart
+		return cls.__encode_cursor([change[k.lower()] for k, _ in CHANGE_ORDERING])
+
+	@classmethod
+	def __lazy_set(cls, lazy=None) -> set:
+		if lazy is None:
+			return set(cls.lazy_fields)
+		if lazy == True:
+			return set([k for k, v in cls.__dependencies.items() if not v['is_value']])
+		if lazy == False:
+			return set()
+		if isinstance(lazy, str):
+			lazy = [lazy]
+		for field_name in lazy:
+			if field_name not in cls.__dependencies or cls.__dependencies[field_name]['is_value']:
+				raise ValueError(f"'{field_name}' is not a relationship of {cls.__name__}")
+		return set(lazy)
+
+	@classmethod
+	def __related_tree(cls, select_related=None, lazy=None):
+		# None loads the whole graph, an int the first levels of it and a list of dotted paths only those relationships
+		# lazy relationships are left out unless a path names them
+		if lazy is None:
+			lazy = set(cls.lazy_fields)
+		if select_related is None or isinstance(select_related, int):
+			if select_related is not None and select_related <= 0:
+				return {}
+			depth = None if select_related is None else select_related - 1
+			return {k: v['type'].__related_tree(depth) for k, v in cls.__dependencies.items() if not v['is_value'] and k not in lazy}
+		if isinstance(select_related, str):
+			select_related = [select_related]
+		tree = {}
+		for path in select_related:
+			current_cls, node = cls, tree
+			for field_name in path.split("."):
+				dependency = current_cls.__dependencies.get(field_name)
+				if dependency is None or dependency['is_value']:
+					raise ValueError(f"'{field_name}' is not a relationship of {current_cls.__name__}")
+				node = node.setdefault(field_name, {})
+				current_cls = dependency['type']
+		return tree
+
+	@classmethod
+	def __snapshot_tree(cls):
+		# a past state can't be completed later, so every relationship is loaded with the objects
+		return {k: v['type'].__snapshot_tree() for k, v in cls.__dependencies.items() if not v['is_value']}
+
+	@classmethod
+	def __related_columns(cls, alias, tree, only_current=True, only_active=True, aliases=None, fields=None, as_of=None):
+		# one aggregated jsonb subquery per relationship, nested ones are built into the rows of their parent
+		# a relationship mapped to None in the tree only aggregates the related ids
+		# with as_of (an SQL timestamp expression) relationships are read as they were at that moment
+		if aliases is None:
+			aliases = count(1)
+		flags = (["DLA_is_current"] if only_current else []) + (["DLA_is_active"] if only_active else [])
+		out = {}
+		for k, v in cls.__dependencies.items():
+			if fields is not None and k not in fields:
+				continue
+			if not v['is_value'] and k not in tree:
+				continue
+			link = f"dla_r{next(aliases)}"
+			link_conditions = " AND ".join([f"{link}.first_id = {alias}.{cls.identifier_field}"] + [f"{link}.{i}" for i in flags])
+			link_source = v['table'].source(only_current)
+			if as_of is not None:
+				# writes only store the slots they change (removed ones as inactive rows), each slot is its latest row up to as_of
+				link_source = v['table'].snapshot(as_of, ["first_id", "list_index"], f"first_id = {alias}.{cls.identifier_field}")
+				link_conditions = f"{link}.DLA_is_active"
+			if v['is_value']:
+				out[k.lower()] = f"SELECT jsonb_agg({link}.value ORDER BY {link}.list_index) FROM {link_source} {link} WHERE {link_conditions}"
+				continue
+			dep = v['type']
+			dep_alias = f"dla_r{next(aliases)}"
+			nested = dep.__related_columns(dep_alias, tree[k], aliases=aliases, as_of=as_of) if tree[k] is not None else {}
+			row = f"to_jsonb({dep_alias})" if tree[k] is not None else f"{link}.second_id"
+			if len(nested) > 0:
+				pairs = [f"'{name}', ({expr})" for name, expr in nested.items()]
+				row += f" || jsonb_build_object({', '.join(pairs)})"
+			if as_of is None:
+				join = f"{dep.__table.table_name} {dep_alias} ON {dep_alias}.{dep.identifier_field} = {link}.second_id AND {dep_alias}.DLA_is_current AND {dep_alias}.DLA_is_active"
+			else:
+				snapshot = dep.__table.snapshot(as_of, [dep.identifier_field], f"{dep.identifier_field} = {link}.second_id")
+				join = f"LATERAL {snapshot} {dep_alias} ON {dep_alias}.DLA_is_active"
+			out[k.lower()] = f"SELECT jsonb_agg({row} ORDER BY {link}.list_index) FROM {link_source} {link} JOIN {join} WHERE {link_conditions}"
+		return out
+
+	@classmethod
+	def __projection(cls, fields, ordering=None):
+		if isinstance(fields, str):
+			fields = fields.split(",")
+		fields = [i.strip() for i in fields]
+		for field_name in fields:
+			if field_name not in cls.model_fields:
+				raise ValueError(f"'{field_name}' is not a field of {cls.__name__}")
+		# the ordering fields are needed to build the next cursor
+		for k, _ in ordering or []:
+			if k not in fields:
+				fields.append(k)
+		return fields
+
+	@classmethod
+	def __project(cls, res, fields):
+		out = []
+		for row in res.to_dicts():
+			item = {}
+			for field_name in fields:
+				value = row[field_name.lower()]
+				dependency = cls.__dependencies.get(field_name)
+				if dependency is not None:
+					value = json.loads(value) if value is not None else []
+					if dependency['is_value']:
+						value = cls.__field_adapters[field_name].validate_python(value)
+					else:
+						value = cls.__related_value(dependency, value)
+				item[field_name] = value
+			out.append(item)
+		return out
+
+	@staticmethod
+	def __as_of(as_of):
+		if as_of is None:
+			return None
+		as_of = TypeAdapter(datetime).validate_python(as_of)
+		# DLA_modified_at is written in local time
+		if as_of.tzinfo is not None:
+			as_of = as_of.astimezone().replace(tzinfo=None)
+		return as_of
+
+	@classmethod
+	def __update_info(cls, filter = None, limit=10, only_current=True, only_active=True, order_by=None, after=None, select_related=None, lazy=None, fields=None, as_of=None):
+		ordering = None
+		if order_by is not None or after is not None:
+			ordering = cls.__ordering(order_by)
+		if after is not None:
+			after = cls.__decode_cursor(ordering, after)
+		source = None
+		moment = as_of
+		if moment is not None:
+			as_of = AS_OF
+			source = cls.__table.snapshot(as_of, [cls.identifier_field])
+			only_current = False
+		if fields is not None:
+			fields = cls.__projection(fields, ordering)
+			tree = {k: None for k in fields if k in cls.__dependencies and not cls.__dependencies[k]['is_value']}
+			related = cls.__related_columns(cls.__table.alias, tree, only_current, only_active, fields=fields, as_of=as_of)
+			columns = [k for k in fields if k not in cls.__dependencies]
+			if filter is None:
+				res = yield from cls.__table.get_all(limit, only_current, only_active, ordering, after, related, columns, source, moment)
+			else:
+				res = yield from cls.__table.filter(filter, limit, only_current, only_active, ordering, after, related, columns, source, moment)
+			return cls.__project(res, fields)
+		if as_of is None:
+			lazy = cls.__lazy_set(lazy)
+			tree = cls.__related_tree(select_related, lazy)
+		else:
+			lazy = set()
+			tree = cls.__snapshot_tree()
+		related = cls.__related_columns(cls.__table.alias, tree, only_current, only_active, as_of=as_of)
 		if filter is None:
-			res = cls.__table.get_all(limit, only_current, only_active)
+			res = yield from cls.__table.get_all(limit, only_current, only_active, ordering, after, related, source=source, as_of=moment)
 		else:
-			res = cls.__table.filter(filter, limit, only_current, only_active)
-		obj_lis = res.to_dicts()
-		if obj_lis == []:
+			res = yield from cls.__table.filter(filter, limit, only_current, only_active, ordering, after, related, source=source, as_of=moment)
+		return (yield from cls.__hydrate(res, tree, lazy - set(tree), only_current, only_active, detached=as_of is not None))
+
+	@classmethod
+	def __hydrate(cls, res, tree, lazy, only_current=True, only_active=True, detached=False):
+		rows = res.to_dicts()
+		for row in rows:
+			for k, v in cls.__dependencies.items():
+				if v['is_value'] or k in tree:
+					row[k.lower()] = json.loads(row[k.lower()]) if row[k.lower()] is not None else None
+		return (yield from cls.__build(rows, tree, lazy, only_current, only_active, detached))
+
+	@classmethod
+	def __load_related(cls, dependency, id_list, only_current=True, only_active=True):
+		res = yield from dependency['table'].filter(lambda x: x.first_id in id_list, None, only_current=only_current, only_active=only_active)
+		if len(res) == 0:
+			return {}
+		ids = list(set(res['second_id'].to_list()))
+		id_field = dependency['type'].identifier_field
+		objects = yield from dependency['type'].__update_info(lambda x: x[id_field] in ids, limit=None)
+		by_id = {getattr(obj, id_field): obj for obj in objects}
+		grouped = res.sort('list_index').group_by('first_id', maintain_order=True).agg(pl.col('second_id'))
+		return {first_id: [by_id[i] for i in lis if i in by_id] for first_id, lis in zip(grouped['first_id'].to_list(), grouped['second_id'].to_list())}
+
+	@staticmethod
+	def __related_value(dependency, lis):
+		if dependency['is_list']:
+			return lis
+		return lis[0] if lis != [] else None
+
+	@classmethod
+	def __build(cls, rows, tree, lazy, only_current=True, only_active=True, detached=False):
+		if rows == []:
 			return []
-		id_list = res[cls.identifier_field].to_list()
-		
-		table_results = {}
-		dep_tables_required_ids = {}
+		id_list = [row[cls.identifier_field] for row in rows]
+
+		grouped_results = {}
 		for k, v in cls.__dependencies.items():
-			if v['is_value']:
+			if v['is_value'] or k in lazy:
 				continue
-			table_results[k] = v['table'].filter(lambda x: x.first_id in id_list, None, only_current=only_current, only_active=only_active)
-			ids = set(table_results[k]['second_id'].to_list())
-			t_name = v['type'].__name__
-			if t_name not in dep_tables_required_ids:
-				dep_tables_required_ids[t_name] = {"type": v['type'], "ids": ids}
-			else:
-				dep_tables_required_ids[t_name]["ids"] = dep_tables_required_ids[t_name]["ids"].union(ids)
-		
-		dep_tables = {}
-		for k, v in dep_tables_required_ids.items():
-			l = list(v['ids'])
-			id_field = v['type'].identifier_field
-			dep_tables[k] = {}
-			if len(l) == 0:
+			if k not in tree:
+				grouped_results[k] = yield from cls.__load_related(v, id_list, only_current, only_active)
 				continue
-			res = v['type'].filter(lambda x: x[id_field] in l)
-			for obj in res:
-				dep_tables[k][getattr(obj, v['type'].identifier_field)] = obj
+			dep = v['type']
+			dep_rows = {}
+			for row in rows:
+				for dep_row in row[k.lower()] or []:
+					dep_rows[dep_row[dep.identifier_field]] = dep_row
+			objects = yield from dep.__build(list(dep_rows.values()), tree[k], set(dep.lazy_fields) - set(tree[k]), detached=detached)
+			by_id = {getattr(obj, dep.identifier_field): obj for obj in objects}
+			grouped_results[k] = {}
+			for row in rows:
+				grouped_results[k][row[cls.identifier_field]] = [by_id[i[dep.identifier_field]] for i in row[k.lower()] or [] if i[dep.identifier_field] in by_id]
 
 		out = []
-		for obj in obj_lis:
-			for key in cls.__dependencies:
-				if cls.__dependencies[key]['is_value']:
-					obj_id = obj[cls.identifier_field]
-					res = cls.__dependencies[key]['table'].filter(lambda x: x.first_id == obj_id)['value'].to_list()
-					obj[key] = res
-					continue
-				df = table_results[key]
-				val_lis = []
-				t_name = cls.__dependencies[key]["type"].__name__
-				if len(df) > 0:
-					lis = df.filter(df['first_id'] == obj[cls.identifier_field])['second_id'].to_list()
-					for row in lis:
-						val = dep_tables[t_name].get(row)
-						if val is not None:
-							val_lis.append(val)
-				obj[key] = val_lis
-				if not cls.__dependencies[key]['is_list']:
-					if obj[key] != []:
-						obj[key] = obj[key][0]
-					else:
-						obj[key] = None
-			updt = cls.__update_individual(obj)
+		for row in rows:
+			obj = {key: value for key, value in row.items() if key not in [k.lower() for k in cls.__dependencies]}
+			for key, dependency in cls.__dependencies.items():
+				if dependency['is_value']:
+					obj[key] = row[key.lower()] or []
+				elif key not in lazy:
+					obj[key] = cls.__related_value(dependency, grouped_results[key].get(row[cls.identifier_field], []))
+			updt = cls.__update_individual(obj, detached)
 			if updt is not None:
 				out.append(updt)
+		for key in lazy:
+			# a value loaded by an earlier query may be stale, it's dropped and reloaded on access like for new instances
+			relation = LazyRelation(key, out)
+			for obj in out:
+				obj.__dict__.pop(key, None)
+				obj._dla_lazy[key] = relation
 		return out
 
 	@classmethod
-	def new(cls, **kwargs):
+	def __resolve_lazy(cls, objects, fields=None):
+		relations = []
+		for obj in objects:
+			for key, relation in obj._dla_lazy.items():
+				if (fields is None or key in fields) and relation not in relations:
+					relations.append(relation)
+		for relation in relations:
+			pending = relation.pending()
+			if len(pending) == 0:
+				continue
+			dependency = cls.__dependencies[relation.field_name]
+			loaded = yield from cls.__load_related(dependency, [obj[cls.identifier_field] for obj in pending])
+			for obj in pending:
+				obj.__dict__[relation.field_name] = cls.__related_value(dependency, loaded.get(obj[cls.identifier_field], []))
+				obj._dla_lazy.pop(relation.field_name, None)
+
+	@classmethod
+	def load_related(cls, objects : list["Object"], fields : list[str] = None):
+		run_sync(cls.__resolve_lazy(objects, fields))
+
+	@classmethod
+	async def aload_related(cls, objects : list["Object"], fields : list[str] = None):
+		await run_async(cls.__resolve_lazy(objects, fields))
+
+	def __getattr__(self, name):
+		try:
+			lazy = object.__getattribute__(self, '__pydantic_private__')['_dla_lazy']
+		except (AttributeError, KeyError, TypeError):
+			lazy = None
+		if lazy and name in lazy:
+			run_sync(type(self).__resolve_lazy([self], [name]))
+			return self.__dict__[name]
+		return super().__getattr__(name)
+
+	@classmethod
+	def __dependency_rows(cls, obj_id, dependency, value, dla_data):
+		return cls.__slot_rows(obj_id, dependency, dict(enumerate(cls.__slots(dependency, value))), dla_data)
+
+	@staticmethod
+	def __slots(dependency, value) -> tuple:
+		# what each list_index of a relationship table holds for a value of the field
+		if not dependency['is_list']:
+			value = [] if value is None else [value]
+		if dependency['is_value']:
+			return tuple(value)
+		return tuple([i[dependency['type'].identifier_field] for i in value])
+
+	@staticmethod
+	def __slot_rows(obj_id, dependency, slots : dict, dla_data):
+		rows = []
+		for idx, i in slots.items():
+			row = {
+				'connection_id': primary_key.generate(),
+				"first_id": obj_id
+			}
+			row["value" if dependency['is_value'] else "second_id"] = i
+			row["list_index"] = idx
+			rows.append({**row, **dla_data()})
+		return rows
+
+	def __remember(self, keys):
+		# the persisted value of each column, update() diffs against it to write only what changed
+		# relationships aren't kept, their tables are diffed against the stored slots on update
+		for key in keys:
+			if key in self.__dict__ and key not in self.__dependencies:
+				self._dla_state[key] = self.__dict__[key]
+
+	def __expire(self):
+		# what's in memory was never committed, the next read reloads it and the next update writes every field
+		self._dla_state.clear()
+		self._dla_version = None
+
+	@classmethod
+	def __discard(cls, objects):
+		for obj in objects:
+			obj.__expire()
+			cls.__objects_map.pop(str(obj[cls.identifier_field]))
+
+	@classmethod
+	def __current_slots(cls, dependency, obj_id):
+		# read without flushing the open transaction, its pending rows are applied over the stored ones
+		table = dependency['table']
+		res = yield from table.filter(lambda x: x.first_id == obj_id, None, flush=False)
+		column = "value" if dependency['is_value'] else "second_id"
+		out = {row["list_index"]: row[column] for row in res.to_dicts()}
+		unit_of_work = table.db.unit_of_work
+		if unit_of_work is None:
+			return out
+		superseded, rows = unit_of_work.pending_changes(table)
+		if (obj_id,) in superseded.get(("first_id",), set()):
+			out = {}
+		for row in rows:
+			if row["first_id"] != obj_id or not row["DLA_is_current"]:
+				continue
+			if row["DLA_is_active"]:
+				out[row["list_index"]] = row[column]
+			else:
+				out.pop(row["list_index"], None)
+		return out
+
+	@classmethod
+	def __build_rows(cls, objects_kwargs, dla_data, keep_identifier=False):
+		out = []
+		rows = {cls.__table.table_name: []}
+		for v in cls.__dependencies.values():
+			rows[v['table'].table_name] = []
+		for kwargs in objects_kwargs:
+			if not keep_identifier:
+				kwargs = {k: v for k, v in kwargs.items() if k != cls.identifier_field}
+			obj = cls(**kwargs)
+			data = obj.model_dump(exclude=set(cls.__dependencies))
+			rows[cls.__table.table_name].append({**data, **dla_data()})
+			for field, v in cls.__dependencies.items():
+				rows[v['table'].table_name] += cls.__dependency_rows(obj[cls.identifier_field], v, getattr(obj, field), dla_data)
+			out.append(obj)
+		return out, rows
+
+	@classmethod
+	def __new_many(cls, objects_kwargs):
 		if cls.__table is None:
 			raise ImportError('DB not defined')
-		if cls.identifier_field in kwargs:
-			del kwargs[cls.identifier_field]
-		out = cls(**kwargs)
-		data = out.to_dict()
-		for i in cls.__dependencies:
-			del data[i]
-		dla_data = dla_dict("INSERT", is_current=True)
-		cls.__table.insert({**data, **dla_data()})
-		for field, v in cls.__dependencies.items():
-			if v['is_list']:
-				new_rows = []
-				if v['is_value']:
-					for idx, i in enumerate(getattr(out, field)):
-						new_rows.append({
-							'connection_id': primary_key.generate(),
-							"first_id": out[cls.identifier_field],
-							"value": i,
-							"list_index": idx,
-							**dla_data()
-						})
-				else:
-					for idx, i in enumerate(getattr(out, field)):
-						new_rows.append({
-							'connection_id': primary_key.generate(),
-							"first_id": out[cls.identifier_field],
-							"second_id": i[v['type'].identifier_field],
-							"list_index": idx,
-							**dla_data()
-						})
-				for j in new_rows:
-					v['table'].insert(j)
-			else:
-				val = getattr(out, field)
-				if val is not None:
-					v['table'].insert({
-						'connection_id': primary_key.generate(),
-						"first_id": out[cls.identifier_field],
-						"second_id": val[v['type'].identifier_field],
-						"list_index": 0,
-						**dla_data()
-					})
-		cls.__objects_map[str(out[cls.identifier_field])] = out
-		cls.__objects_list.append(out)
+		out, rows = cls.__build_rows(objects_kwargs, dla_dict("INSERT", is_current=True))
+		unit_of_work = UnitOfWork()
+		for table in cls.get_tables():
+			unit_of_work.insert(table, rows[table.table_name])
+		unit_of_work.on_rollback(partial(cls.__discard, out))
+		yield from cls.__table.db.commit_unit_of_work(unit_of_work)
+		for obj, row in zip(out, rows[cls.__table.table_name]):
+			obj.__remember(cls.model_fields)
+			obj.__loaded(row['DLA_object_id'])
+			cls.__objects_map.put(str(obj[cls.identifier_field]), obj)
 		return out
-	
-	def history(self):
-		self_res = self.__table.filter(lambda x: x[self.identifier_field] == getattr(self, self.identifier_field), limit=None, only_active=False, only_current=False)
-		out = {
-			"self": self_res.to_dicts(),
-			"dependencies": {}
-		}
-		for k, v in self.__dependencies.items():
-			dep_res = v['table'].filter(lambda x: x.first_id == getattr(self, self.identifier_field), limit=None, only_active=False, only_current=False)
-			out['dependencies'][k] = dep_res.to_dicts()
+
+	@classmethod
+	def __bulk_load(cls, data, batch_size):
+		dla_data = dla_dict("INSERT", is_current=True)
+		if isinstance(data, pl.DataFrame):
+			data = data.iter_rows(named=True)
+		data = iter(data)
+		total = 0
+		while True:
+			batch = list(islice(data, batch_size))
+			if len(batch) == 0:
+				break
+			out, rows = cls.__build_rows(batch, dla_data, keep_identifier=True)
+			for table in cls.get_tables():
+				yield from table.copy_in(rows[table.table_name])
+			total += len(out)
+		return total
+
+	@classmethod
+	def __histories(cls, ids):
+		id_field = cls.identifier_field
+		keys = {str(i): i for i in ids}
+		out = {i: {"self": [], "dependencies": {k: [] for k in cls.__dependencies}} for i in keys.values()}
+		if len(keys) == 0:
+			return out
+		id_list = list(keys.keys())
+		ordering = [("DLA_modified_at", False)]
+		self_res = yield from cls.__table.filter(lambda x: x[id_field] in id_list, None, only_current=False, only_active=False, order_by=ordering)
+		for row in self_res.to_dicts():
+			out[keys[str(row[id_field])]]["self"].append(row)
+		for k, v in cls.__dependencies.items():
+			dep_res = yield from v['table'].filter(lambda x: x.first_id in id_list, None, only_current=False, only_active=False, order_by=ordering)
+			for row in dep_res.to_dicts():
+				out[keys[str(row["first_id"])]]["dependencies"][k].append(row)
 		return out
+
+	def __history(self):
+		obj_id = self[self.identifier_field]
+		out = yield from self.__histories([obj_id])
+		return out[obj_id]
+
+	@classmethod
+	def __changes(cls, since, after, batch_size):
+		alias = cls.__table.alias
+		# relationships as they were right after each change, as ids
+		tree = {k: None for k, v in cls.__dependencies.items() if not v['is_value']}
+		related = cls.__related_columns(alias, tree, False, False, as_of=f"{alias}.DLA_modified_at")
+		if since is None:
+			res = yield from cls.__table.get_all(batch_size, False, False, CHANGE_ORDERING, after, related)
+		else:
+			res = yield from cls.__table.filter(lambda x: x.DLA_modified_at > since, batch_size, False, False, CHANGE_ORDERING, after, related)
+		return cls.__project(res, list(cls.model_fields) + [k.lower() for k in cls.__table.schema if k.upper().startswith("DLA_")])
 	
-	def update(self, **kwargs):
-		data = {}
-		for key in self.to_dict():
-			if key in kwargs:
-				data[key] = kwargs[key]
-			elif key not in self.__class__.__dependencies:
-				data[key] = getattr(self, key)
-		dla_data_insert = dla_dict("UPDATE", is_current=True)
+	def __update(self, **kwargs):
+		id_field = self.identifier_field
+		obj_id = self[id_field]
+		modified_at = datetime.now()
+		dla_data_insert = dla_dict("UPDATE", modified_at, is_current=True)
+		dla_data_removed = dla_dict("UPDATE", modified_at, is_current=True, is_active=False)
+		unit_of_work = UnitOfWork()
+		dirty = False
+		for key, value in kwargs.items():
+			if key in self.__field_adapters:
+				kwargs[key] = value = self.__field_adapters[key].validate_python(value)
+			dependency = self.__dependencies.get(key)
+			if dependency is None:
+				dirty = dirty or key not in self._dla_state or self._dla_state[key] != value
+				continue
+			# the loaded value may be stale, only the slots that differ from the stored ones are written, removed slots as inactive rows
+			current = yield from self.__current_slots(dependency, obj_id)
+			slots = dict(enumerate(self.__slots(dependency, value)))
+			changed = {i: v for i, v in slots.items() if i not in current or current[i] != v}
+			removed = {i: v for i, v in current.items() if i not in slots}
+			if len(changed) + len(removed) > 0:
+				dirty = True
+				unit_of_work.supersede(dependency['table'], ['first_id', 'list_index'], [(obj_id, i) for i in [*changed, *removed]])
+				unit_of_work.insert(dependency['table'], self.__slot_rows(obj_id, dependency, changed, dla_data_insert) + self.__slot_rows(obj_id, dependency, removed, dla_data_removed))
+		if dirty:
+			data = {}
+			for key in self.__class__.model_fields:
+				if key not in self.__dependencies:
+					data[key] = kwargs[key] if key in kwargs else getattr(self, key)
+			# the main row is written on any change, it carries the version
+			row = {**data, **dla_data_insert()}
+			unit_of_work.supersede(self.__table, [id_field], [(obj_id,)])
+			unit_of_work.insert(self.__table, [row])
+			unit_of_work.on_rollback(self.__expire)
+			yield from self.__table.db.commit_unit_of_work(unit_of_work)
+			self.__loaded(row['DLA_object_id'])
+			yield from self.__publish_invalidation([obj_id])
 		for key, value in kwargs.items():
-			if key in self.__dependencies:
-				del data[key]
-				dependency = self.__dependencies[key]
-				dependency['table'].update(lambda x: x.first_id == self.id, {'DLA_is_current': False})
-				new_rows = []
-				if dependency['is_list']:
-					if dependency['is_value']:
-						for idx, i in enumerate(value):
-							new_rows.append({
-								'connection_id': primary_key.generate(),
-								"first_id": self[self.identifier_field],
-								"value": i,
-								"list_index": idx,
-								**dla_data_insert()
-							})
-					else:
-						for idx, i in enumerate(value):
-							new_rows.append({
-								'connection_id': primary_key.generate(),
-								"first_id": self[self.identifier_field],
-								"second_id": i[dependency['type'].identifier_field],
-								"list_index": idx,
-								**dla_data_insert()
-							})
-				else:
-					if value is not None:
-						new_rows.append({
-							'connection_id': primary_key.generate(),
-							"first_id": self[self.identifier_field],
-							"second_id": value[dependency['type'].identifier_field],
-							"list_index": 0,
-							**dla_data_insert()
-						})
-				for j in new_rows:
-					dependency['table'].insert(j)
 			setattr(self, key, value)
-		self.__table.update(lambda x: x[self.identifier_field] == self.id, {'DLA_is_current': False})
-		self.__table.insert({**data, **dla_data_insert()})
+			self._dla_lazy.pop(key, None)
+		self.__remember(kwargs)
 	
-	def delete(self):
+	def __delete(self):
+		yield from self.__resolve_lazy([self])
 		data = {}
 		for key in self.__class__.model_fields:
 			data[key] = getattr(self, key)
+		id_field = self.identifier_field
+		obj_id = self[id_field]
 		dla_data_delete = dla_dict("DELETE", is_current=True, is_active=False)
+		unit_of_work = UnitOfWork()
 		for key, dependency in self.__dependencies.items():
 			del data[key]
-			dependency['table'].update(lambda x: x.first_id == self.id, {'DLA_is_current': False})
-			value = getattr(self, key)
-			if value is None:
-				continue
-			new_rows = []
-			if dependency['is_list']:
-				if dependency['is_value']:
-					for idx, i in enumerate(value):
-						new_rows.append({
-							'connection_id': primary_key.generate(),
-							"first_id": self[self.identifier_field],
-							"value": i,
-							"list_index": idx,
-							**dla_data_delete()
-						})
-				else:
-					for idx, i in enumerate(value):
-						new_rows.append({
-							'connection_id': primary_key.generate(),
-							"first_id": self[self.identifier_field],
-							"second_id": i[dependency['type'].identifier_field],
-							"list_index": idx,
-							**dla_data_delete()
-						})
-			else:
-				if value is not None:
-					new_rows.append({
-						'connection_id': primary_key.generate(),
-						"first_id": self[self.identifier_field],
-						"second_id": value[dependency['type'].identifier_field],
-						"list_index": 0,
-						**dla_data_delete()
-					})
-			for j in new_rows:
-				dependency['table'].insert(j)
-		self.__table.update(lambda x: x[self.identifier_field] == self.id, {'DLA_is_current': False})
-		self.__table.insert({**data, **dla_data_delete()})
+			unit_of_work.supersede(dependency['table'], ['first_id'], [(obj_id,)])
+			unit_of_work.insert(dependency['table'], self.__dependency_rows(obj_id, dependency, getattr(self, key), dla_data_delete))
+		unit_of_work.supersede(self.__table, [id_field], [(obj_id,)])
+		unit_of_work.insert(self.__table, [{**data, **dla_data_delete()}])
+		yield from self.__table.db.commit_unit_of_work(unit_of_work)
+		self._dla_version = None
+		self.__objects_map.pop(str(obj_id))
+		yield from self.__publish_invalidation([obj_id])
+
+	@classmethod
+	def __publish_invalidation(cls, keys):
+		if not cls.cache_ttl:
+			return
+		yield from cls.__table.db.publish_invalidation(cls.__name__, [str(key) for key in keys])
 
 
 
 	@classmethod
-	def all(cls, limit=10):
-		out = cls.__update_info(limit=limit)
-		return out
+	def delete_all(cls):
+		return run_sync(cls.__delete_all())
+
+	@classmethod
+	async def adelete_all(cls):
+		return await run_async(cls.__delete_all())
+
+	@classmethod
+	def new_many(cls, objects_kwargs):
+		return run_sync(cls.__new_many(objects_kwargs))
+
+	@classmethod
+	async def anew_many(cls, objects_kwargs):
+		return await run_async(cls.__new_many(objects_kwargs))
+
+	@classmethod
+	def bulk_load(cls, data, batch_size=BULK_LOAD_BATCH_SIZE):
+		if cls.__table is None:
+			raise ImportError('DB not defined')
+		return run_sync(cls.__table.db.atomic(cls.__bulk_load(data, batch_size)))
+
+	@classmethod
+	async def abulk_load(cls, data, batch_size=BULK_LOAD_BATCH_SIZE):
+		if cls.__table is None:
+			raise ImportError('DB not defined')
+		return await run_async(cls.__table.db.atomic(cls.__bulk_load(data, batch_size)))
+
+	@classmethod
+	def __open_cursor(cls, filter, tree):
+		if cls.__table is None:
+			raise ImportError('DB not defined')
+		return (yield from cls.__table.open_cursor(filter, related=cls.__related_columns(cls.__table.alias, tree)))
+
+	@classmethod
+	def __fetch_batch(cls, cursor, batch_size, tree, lazy):
+		res = yield partial(cls.__table.db.fetch_cursor, cursor, batch_size)
+		if res is None or len(res) == 0:
+			return None
+		return (yield from cls.__hydrate(res, tree, lazy))
+
+	@classmethod
+	def __close_cursor(cls, cursor):
+		yield partial(cls.__table.db.close_cursor, cursor)
+
+	@classmethod
+	def iter(cls, filter=None, batch_size=ITER_BATCH_SIZE, select_related=None, lazy=None):
+		lazy = cls.__lazy_set(lazy)
+		tree = cls.__related_tree(select_related, lazy)
+		cursor = run_sync(cls.__open_cursor(filter, tree))
+		try:
+			while True:
+				batch = run_sync(cls.__fetch_batch(cursor, batch_size, tree, lazy - set(tree)))
+				if batch is None:
+					break
+				yield from batch
+		finally:
+			run_sync(cls.__close_cursor(cursor))
+
+	@classmethod
+	async def aiter(cls, filter=None, batch_size=ITER_BATCH_SIZE, select_related=None, lazy=None):
+		lazy = cls.__lazy_set(lazy)
+		tree = cls.__related_tree(select_related, lazy)
+		cursor = await run_async(cls.__open_cursor(filter, tree))
+		try:
+			while True:
+				batch = await run_async(cls.__fetch_batch(cursor, batch_size, tree, lazy - set(tree)))
+				if batch is None:
+					break
+				for obj in batch:
+					yield obj
+		finally:
+			await run_async(cls.__close_cursor(cursor))
+
+	@classmethod
+	def new(cls, **kwargs):
+		return cls.new_many([kwargs])[0]
+
+	@classmethod
+	async def anew(cls, **kwargs):
+		return (await cls.anew_many([kwargs]))[0]
+
+	def history(self):
+		return run_sync(self.__history())
+
+	async def ahistory(self):
+		return await run_async(self.__history())
+
+	@classmethod
+	def histories(cls, ids : list[str]) -> dict:
+		return run_sync(cls.__histories(ids))
+
+	@classmethod
+	async def ahistories(cls, ids : list[str]) -> dict:
+		return await run_async(cls.__histories(ids))
+
+	@classmethod
+	def changes_since(cls, since=None, batch_size=ITER_BATCH_SIZE, after=None):
+		since = cls.__as_of(since)
+		if after is not None:
+			after = cls.__decode_cursor(CHANGE_ORDERING, after)
+		while True:
+			batch = run_sync(cls.__changes(since, after, batch_size))
+			yield from batch
+			if len(batch) < batch_size:
+				break
+			after = [batch[-1]["dla_modified_at"], batch[-1]["dla_object_id"]]
+
+	@classmethod
+	async def achanges_since(cls, since=None, batch_size=ITER_BATCH_SIZE, after=None):
+		since = cls.__as_of(since)
+		if after is not None:
+			after = cls.__decode_cursor(CHANGE_ORDERING, after)
+		while True:
+			batch = await run_async(cls.__changes(since, after, batch_size))
+			for row in batch:
+				yield row
+			if len(batch) < batch_size:
+				break
+			after = [batch[-1]["dla_modified_at"], batch[-1]["dla_object_id"]]
+
+	def update(self, **kwargs):
+		return run_sync(self.__update(**kwargs))
+
+	async def aupdate(self, **kwargs):
+		return await run_async(self.__update(**kwargs))
+
+	def delete(self):
+		return run_sync(self.__delete())
+
+	async def adelete(self):
+		return await run_async(self.__delete())
+
+	@classmethod
+	def all(cls, limit=10, order_by=None, after=None, select_related=None, lazy=None, fields=None, as_of=None):
+		return run_sync(cls.__update_info(limit=limit, order_by=order_by, after=after, select_related=select_related, lazy=lazy, fields=fields, as_of=cls.__as_of(as_of)))
+
+	@classmethod
+	async def aall(cls, limit=10, order_by=None, after=None, select_related=None, lazy=None, fields=None, as_of=None):
+		return await run_async(cls.__update_info(limit=limit, order_by=order_by, after=after, select_related=select_related, lazy=lazy, fields=fields, as_of=cls.__as_of(as_of)))
 	
 	@classmethod
-	def filter(cls, lambda_f, limit=10):
-		out = cls.__update_info(filter=lambda_f, limit=limit)
-		return out
+	def filter(cls, lambda_f, limit=10, order_by=None, after=None, select_related=None, lazy=None, fields=None, as_of=None):
+		return run_sync(cls.__update_info(filter=lambda_f, limit=limit, order_by=order_by, after=after, select_related=select_related, lazy=lazy, fields=fields, as_of=cls.__as_of(as_of)))
+	
+	@classmethod
+	async def afilter(cls, lambda_f, limit=10, order_by=None, after=None, select_related=None, lazy=None, fields=None, as_of=None):
+		return await run_async(cls.__update_info(filter=lambda_f, limit=limit, order_by=order_by, after=after, select_related=select_related, lazy=lazy, fields=fields, as_of=cls.__as_of(as_of)))
+	
+	@classmethod
+	def __get_by_id(cls, id_param, select_related=None, lazy=None, as_of=None):
+		id_field = cls.identifier_field
+		if cls.cache_ttl and as_of is None:
+			cached = cls.__objects_map.get(str(id_param))
+			if cached is not None and cached._dla_version is not None:
+				if time.monotonic() - cached._dla_loaded_at < cls.cache_ttl:
+					return cached
+				version = yield from cls.__table.get_version(id_field, id_param)
+				if version == cached._dla_version:
+					cached._dla_loaded_at = time.monotonic()
+					return cached
+		res = yield from cls.__update_info(lambda x: x[id_field] == id_param, limit=1, select_related=select_related, lazy=lazy, as_of=as_of)
+		if len(res) == 0:
+			return None
+		return res[0]
+	
+	@classmethod
+	def get_by_id(cls, id_param, select_related=None, lazy=None, as_of=None):
+		return run_sync(cls.__get_by_id(id_param, select_related, lazy, cls.__as_of(as_of)))
 	
 	@classmethod
-	def get_by_id(cls, id_param):
-		cls.__update_info(lambda x: x[cls.identifier_field] == id_param, limit=1)
-		return cls.__objects_map.get(id_param)
+	async def aget_by_id(cls, id_param, select_related=None, lazy=None, as_of=None):
+		return await run_async(cls.__get_by_id(id_param, select_related, lazy, cls.__as_of(as_of)))
+	
+	@classmethod
+	def __table_columns(cls, fields):
+		if fields is None:
+			return None
+		if isinstance(fields, str):
+			fields = fields.split(",")
+		columns = {k.lower(): k for k in cls.__table.schema}
+		out = []
+		for field_name in fields:
+			if field_name.strip().lower() not in columns:
+				raise ValueError(f"'{field_name.strip()}' is not a column of {cls.__name__}")
+			out.append(columns[field_name.strip().lower()])
+		return out
+
+	@classmethod
+	def get_table_res(cls, limit=10, only_current=True, only_active=True, fields=None) -> pl.DataFrame:
+		return run_sync(cls.__table.get_all(limit=limit, only_current=only_current, only_active=only_active, columns=cls.__table_columns(fields)))
 	
 	@classmethod
-	def get_table_res(cls, limit=10, only_current=True, only_active=True) -> pl.DataFrame:
-		return cls.__table.get_all(limit=limit, only_current=only_current, only_active=only_active)
+	async def aget_table_res(cls, limit=10, only_current=True, only_active=True, fields=None) -> pl.DataFrame:
+		return await run_async(cls.__table.get_all(limit=limit, only_current=only_current, only_active=only_active, columns=cls.__table_columns(fields)))
 	
 	def to_dict(self):
 		return self.model_dump()
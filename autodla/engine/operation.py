@@ -0,0 +1,47 @@
+import inspect
+from typing import Any, Callable, Generator
+
+# An operation is a generator that yields zero-argument callables (usually a
+# functools.partial over DB_Connection.execute) and receives their results back.
+# The same operation can then be driven by a sync or an async DB_Connection.
+Operation = Generator[Callable[[], Any], Any, Any]
+
+def run_sync(operation : Operation):
+    result = None
+    error = None
+    while True:
+        try:
+            if error is not None:
+                step = operation.throw(error)
+            else:
+                step = operation.send(result)
+        except StopIteration as e:
+            return e.value
+        error = None
+        try:
+            result = step()
+            if inspect.isawaitable(result):
+                if hasattr(result, "close"):
+                    result.close()
+                raise TypeError("async DB_Connection can't be used from a sync method, use its awaitable counterpart")
+        except Exception as e:
+            result, error = None, e
+
+async def run_async(operation : Operation):
+    result = None
+    error = None
+    while True:
+        try:
+            if error is not None:
+                step = operation.throw(error)
+            else:
+                step = operation.send(result)
+        except StopIteration as e:
+            return e.value
+        error = None
+        try:
+            result = step()
+            if inspect.isawaitable(result):
+                result = await result
+        except Exception as e:
+            result, error = None, e
@@ -0,0 +1,39 @@
+from datetime import datetime, timedelta
+
+# Range partitions of the tables that keep history, keyed on DLA_modified_at
+PARTITION_INTERVALS = ("day", "week", "month", "year")
+PARTITION_KEY = "DLA_modified_at"
+
+def partition_start(interval : str, moment : datetime) -> datetime:
+    start = datetime(moment.year, moment.month, moment.day)
+    if interval == "day":
+        return start
+    if interval == "week":
+        return start - timedelta(days=start.weekday())
+    if interval == "month":
+        return start.replace(day=1)
+    if interval == "year":
+        return start.replace(month=1, day=1)
+    raise ValueError(f"unknown partition interval '{interval}', use one of {', '.join(PARTITION_INTERVALS)}")
+
+def partition_end(interval : str, start : datetime) -> datetime:
+    if interval == "day":
+        return start + timedelta(days=1)
+    if interval == "week":
+        return start + timedelta(days=7)
+    if interval == "month":
+        if start.month == 12:
+            return start.replace(year=start.year + 1, month=1)
+        return start.replace(month=start.month + 1)
+    if interval == "year":
+        return start.replace(year=start.year + 1)
+    raise ValueError(f"unknown partition interval '{interval}', use one of {', '.join(PARTITION_INTERVALS)}")
+
+def partition_ranges(interval : str, since : datetime, until : datetime) -> list[tuple[datetime, datetime]]:
+    out = []
+    start = partition_start(interval, since)
+    while start <= until:
+        end = partition_end(interval, start)
+        out.append((start, end))
+        start = end
+    return out
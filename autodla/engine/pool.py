@@ -0,0 +1,118 @@
+import time
+from contextlib import contextmanager
+from threading import Condition
+from typing import Any, Callable
+
+class PoolTimeout(Exception):
+    pass
+
+class ConnectionPool:
+    def __init__(self, connect : Callable[[], Any], min_size=1, max_size=10, timeout=30.0, check : Callable[[Any], bool] = None, reset : Callable[[Any], None] = None, close : Callable[[Any], None] = None, check_after=5.0):
+        if min_size < 0 or max_size < 1 or min_size > max_size:
+            raise ValueError(f"invalid pool size: min_size={min_size}, max_size={max_size}")
+        self.min_size = min_size
+        self.max_size = max_size
+        self.timeout = timeout
+        self.check_after = check_after
+        self.__connect = connect
+        self.__check = check
+        self.__reset = reset
+        self.__close = close if close is not None else (lambda conn: conn.close())
+        self.__condition = Condition()
+        self.__idle = []
+        self.__size = 0
+        self.__closed = False
+        for _ in range(min_size):
+            self.__idle.append((self.__connect(), time.monotonic()))
+            self.__size += 1
+
+    @property
+    def size(self):
+        return self.__size
+
+    @property
+    def idle(self):
+        return len(self.__idle)
+
+    def getconn(self, timeout=None):
+        timeout = self.timeout if timeout is None else timeout
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            conn, released_at = None, None
+            with self.__condition:
+                while True:
+                    if self.__closed:
+                        raise PoolTimeout("pool is closed")
+                    if self.__idle:
+                        conn, released_at = self.__idle.pop()
+                        break
+                    if self.__size < self.max_size:
+                        self.__size += 1
+                        break
+                    remaining = None if deadline is None else deadline - time.monotonic()
+                    if remaining is not None and remaining <= 0:
+                        raise PoolTimeout(f"no connection available after {timeout} seconds (max_size={self.max_size})")
+                    self.__condition.wait(remaining)
+            if conn is None:
+                try:
+                    return self.__connect()
+                except Exception:
+                    self.__discarded()
+                    raise
+            if self.__is_healthy(conn, released_at):
+                return conn
+            self.__discard(conn)
+
+    def putconn(self, conn, discard=False):
+        if not discard and self.__reset is not None:
+            try:
+                self.__reset(conn)
+            except Exception:
+                discard = True
+        with self.__condition:
+            if discard or self.__closed:
+                pass
+            elif len(self.__idle) < self.max_size:
+                self.__idle.append((conn, time.monotonic()))
+                self.__condition.notify()
+                return
+        self.__discard(conn)
+
+    @contextmanager
+    def connection(self, timeout=None):
+        conn = self.getconn(timeout)
+        try:
+            yield conn
+        finally:
+            self.putconn(conn)
+
+    def closeall(self):
+        with self.__condition:
+            self.__closed = True
+            idle = self.__idle
+            self.__idle = []
+            self.__condition.notify_all()
+        for conn, _ in idle:
+            self.__discard(conn)
+
+    def __is_healthy(self, conn, released_at):
+        if self.__check is None:
+            return True
+        if released_at is not None and time.monotonic() - released_at < self.check_after:
+            return getattr(conn, "closed", False) in [False, 0]
+        try:
+            return self.__check(conn)
+        except Exception:
+            return False
+
+    def __discard(self, conn):
+        try:
+            self.__close(conn)
+        except Exception:
+            pass
+        self.__discarded()
+
+    def __discarded(self):
+        with self.__condition:
+            self.__size -= 1
+            self.__condition.notify()
@@ -1,25 +1,95 @@
+import hashlib
 import polars as pl
-from typing import Callable, List, Optional
+from dataclasses import dataclass
+from typing import Callable, List, Optional, Union
 from autodla.engine.data_conversion import DataTransformer
 
+@dataclass
+class Query:
+    st: str
+    params: tuple = ()
+    result_schema: Optional[dict] = None
+    limit: Optional[int] = None
+
+    @classmethod
+    def of(cls, value: Union["Query", str, None]) -> Optional["Query"]:
+        if value is None or isinstance(value, Query):
+            return value
+        return cls(value)
+
+    @classmethod
+    def join(cls, separator: str, parts: List[Union["Query", str]]) -> "Query":
+        parts = [cls.of(part) for part in parts]
+        return cls(
+            separator.join([part.st for part in parts]),
+            tuple(param for part in parts for param in part.params)
+        )
+
+    def __str__(self):
+        return self.st
+
 class QueryBuilder:
+    MAX_IDENTIFIER_LENGTH = 63
+
     def __init__(self, data_transformer = DataTransformer):
         self._data_transformer = data_transformer
 
-    def select(self, from_table: str, columns: List[str], where: str = None, limit: int = 10, order_by: str = None, group_by: list[str] = None) -> pl.DataFrame:
+    def index_name(self, table_name: str, columns: List[str], where: str = None) -> str:
+        name = f"{table_name.split('.')[-1]}__{'_'.join(columns)}"
+        if where:
+            name += "__partial"
+        name = name.lower()
+        if len(name) > self.MAX_IDENTIFIER_LENGTH:
+            digest = hashlib.md5(f"{table_name}|{columns}|{where}".encode()).hexdigest()[:8]
+            name = f"{name[:self.MAX_IDENTIFIER_LENGTH - 9]}_{digest}"
+        return name
+
+    def partition_name(self, table_name: str, suffix: str) -> str:
+        name = f"{table_name}__{suffix}".lower()
+        schema, _, name = name.rpartition('.')
+        if len(name) > self.MAX_IDENTIFIER_LENGTH:
+            digest = hashlib.md5(f"{table_name}|{suffix}".encode()).hexdigest()[:8]
+            name = f"{name[:self.MAX_IDENTIFIER_LENGTH - len(suffix) - 10]}_{digest}_{suffix}"
+        return f"{schema}.{name}" if schema else name
+
+    def select(self, from_table: str, columns: List[str], where: Union[Query, str] = None, limit: int = 10, order_by: str = None, group_by: list[str] = None) -> Query:
+        pass
+
+    def insert(self, into_table: str, values: List[dict]) -> Query:
+        pass
+
+    def update(self, table: str, values: dict, where: Union[Query, str]) -> Query:
+        pass
+
+    def delete(self, table: str, where: Union[Query, str]) -> Query:
+        pass
+
+    def move_rows(self, from_table: str, to_table: str, columns: List[str], where: Union[Query, str], values: dict = {}) -> Query:
+        pass
+
+    def create_table(self, table_name: str, schema: dict, if_exists = False, partition_by: str = None) -> Query:
+        pass
+
+    def create_table_like(self, table_name: str, like_table: str) -> Query:
+        pass
+
+    def attach_partition(self, table_name: str, partition_name: str, start = None, end = None) -> Query:
         pass
 
-    def insert(self, into_table: str, values: List[dict]) -> None:
+    def detach_partition(self, table_name: str, partition_name: str) -> Query:
         pass
 
-    def update(self, table: str, values: dict, where: str) -> None:
+    def drop_table(self, table_name: str, if_exists = False) -> Query:
         pass
 
-    def delete(self, table: str, where: str) -> None:
+    def create_index(self, table_name: str, columns: List[str], where: str = None, if_not_exists = True) -> Query:
         pass
 
-    def create_table(self, table_name: str, schema: dict, if_exists = False) -> None:
+    def add_column(self, table_name: str, column: str, sql_type: str, not_null = False, default: str = None) -> Query:
         pass
 
-    def drop_table(self, table_name: str, if_exists = False) -> None:
-        pass
\ No newline at end of file
+    def alter_column_type(self, table_name: str, column: str, sql_type: str) -> Query:
+        pass
+
+    def drop_not_null(self, table_name: str, column: str) -> Query:
+        pass
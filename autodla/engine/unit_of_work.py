@@ -0,0 +1,116 @@
+from functools import partial
+from typing import Callable
+from autodla.engine.operation import Operation, run_async, run_sync
+
+class UnitOfWork:
+    def __init__(self):
+        self.__tables = {}
+        self.__log = []
+        self.__rollback_hooks = []
+
+    def __entry(self, table):
+        entry = self.__tables.get(table.table_name)
+        if entry is None:
+            entry = {"table": table, "supersede": {}, "rows": []}
+            self.__tables[table.table_name] = entry
+        return entry
+
+    @property
+    def pending(self) -> bool:
+        return len(self.__log) > 0
+
+    def pending_changes(self, table) -> tuple[dict, list[dict]]:
+        # keys superseded by columns and rows inserted for the table, not written yet
+        entry = self.__tables.get(table.table_name)
+        if entry is None:
+            return {}, []
+        return entry["supersede"], entry["rows"]
+
+    def supersede(self, table, columns : tuple, keys : list[tuple]):
+        columns = tuple(columns)
+        keys = set([tuple(key) for key in keys])
+        if len(keys) == 0:
+            return
+        self.__log.append(("supersede", table, columns, keys))
+        entry = self.__entry(table)
+        for row in entry["rows"]:
+            if row["DLA_is_current"] and tuple([row[column] for column in columns]) in keys:
+                row["DLA_is_current"] = False
+        entry["supersede"].setdefault(columns, set()).update(keys)
+
+    def insert(self, table, rows : list[dict]):
+        if len(rows) == 0:
+            return
+        self.__log.append(("insert", table, rows))
+        self.__entry(table)["rows"] += rows
+
+    def on_rollback(self, hook : Callable[[], None]):
+        # in-memory changes made for these writes, undone if the transaction they end up in is rolled back
+        self.__rollback_hooks.append(hook)
+
+    def merge(self, other : "UnitOfWork"):
+        for action, table, *args in other.__log:
+            getattr(self, action)(table, *args)
+        self.__rollback_hooks += other.__rollback_hooks
+
+    def rolled_back(self):
+        hooks = self.__rollback_hooks
+        self.__rollback_hooks = []
+        for hook in hooks:
+            hook()
+
+    def flush(self) -> Operation:
+        tables = self.__tables
+        self.__tables = {}
+        self.__log = []
+        for entry in tables.values():
+            yield from entry["table"].apply_changes(entry["supersede"], entry["rows"])
+
+class Transaction:
+    def __init__(self, db):
+        self.db = db
+        self.__nested = False
+
+    def __begin(self) -> Operation:
+        if self.db.unit_of_work is not None:
+            self.__nested = True
+            return
+        yield partial(self.db.begin)
+        self.db.set_unit_of_work(UnitOfWork())
+
+    def __end(self, failed) -> Operation:
+        if self.__nested:
+            return
+        unit_of_work = self.db.unit_of_work
+        self.db.set_unit_of_work(None)
+        if failed:
+            yield partial(self.db.rollback)
+            unit_of_work.rolled_back()
+            return
+        try:
+            yield from unit_of_work.flush()
+        except Exception:
+            yield partial(self.db.rollback)
+            unit_of_work.rolled_back()
+            raise
+        try:
+            yield partial(self.db.commit)
+        except Exception:
+            unit_of_work.rolled_back()
+            raise
+
+    def __enter__(self):
+        run_sync(self.__begin())
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        run_sync(self.__end(exc_type is not None))
+        return False
+
+    async def __aenter__(self):
+        await run_async(self.__begin())
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        await run_async(self.__end(exc_type is not None))
+        return False